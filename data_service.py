@@ -0,0 +1,75 @@
+# Background database access for the GUI.
+# Every blocking fetch runs on a small thread pool and its result is handed back through `dispatch` (the GUI passes
+# root.after), so a slow or dropped connection never freezes the Tk event loop.
+# Requests are grouped by channel ("history", "previews", ...). A new request on a channel supersedes the previous
+# one: it's cancelled if it hasn't started yet, and its result is thrown away if it has - so switching chats quickly
+# only ever draws the last one.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+
+
+class DataService:
+    def __init__(self, dispatch, max_workers=MAX_WORKERS):
+        self.dispatch = dispatch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rucksapp-data")
+        self._lock = threading.Lock()
+        self._latest = {}  # channel -> token of the request whose result we still want
+        self._futures = {}  # channel -> future of that request
+        self._tokens = 0
+
+    def submit(self, channel, fetch, on_result=None, on_error=None):
+        # fetch() runs on a worker; on_result(value) or on_error(exc) run on the Tk thread, only if still current
+        with self._lock:
+            self._tokens += 1
+            token = self._tokens
+            self._latest[channel] = token
+            previous = self._futures.pop(channel, None)
+            if previous is not None:
+                previous.cancel()
+            self._futures[channel] = self._executor.submit(self._run, channel, token, fetch, on_result, on_error)
+        return token
+
+    def is_current(self, channel, token):
+        with self._lock:
+            return self._latest.get(channel) == token
+
+    def busy(self, channel):
+        # True from submit() until its result has been delivered (or it's superseded / cancelled)
+        with self._lock:
+            return channel in self._latest
+
+    def cancel(self, channel):
+        with self._lock:
+            self._latest.pop(channel, None)
+            future = self._futures.pop(channel, None)
+            if future is not None:
+                future.cancel()
+
+    def _run(self, channel, token, fetch, on_result, on_error):
+        if not self.is_current(channel, token):
+            return  # superseded while it sat in the queue
+        try:
+            result, error = fetch(), None
+        except Exception as exc:
+            result, error = None, exc
+        self.dispatch(lambda: self._deliver(channel, token, result, error, on_result, on_error))
+
+    def _deliver(self, channel, token, result, error, on_result, on_error):
+        with self._lock:
+            if self._latest.get(channel) != token:
+                return
+            del self._latest[channel]
+            self._futures.pop(channel, None)
+        if error is not None:
+            if on_error is not None:
+                on_error(error)
+            else:
+                print(f"Data service error ({channel}):", error)
+        elif on_result is not None:
+            on_result(result)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
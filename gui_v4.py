@@ -1,16 +1,28 @@
+import bisect
+import itertools
 import os
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
 import tkinter as tk
 from tkinter import filedialog
 
 import customtkinter as ctk
-from PIL import Image
-
+from PIL import Image, ImageTk
+
+from data_service import DataService
+from image_cache import ImageCache
+from refresh_scheduler import RefreshScheduler
+from warmup import WARMUP_TIMEOUT, WarmUp
+import messaging.fanout as fanout
+import messaging.key_cache as key_cache
 import messaging.send_message as send_message
-import spam_detection.main as spam_detection
+from messaging.send_queue import SendQueue
 from user_auth.message_listener import listen_for_messages
+from user_auth.contact_search import contact_search
+from user_auth.poll_scheduler import AdaptivePollScheduler
+from user_auth.user_directory import SERVER_TIMESTAMP, directory
 
 
 class Theme:
@@ -31,28 +43,54 @@ class Theme:
         return ctk.CTkFont(family="Poppins", size=size, weight=weight)
 
 
+GRADIENT_CACHE_SIZE = 8
+_gradient_cache = OrderedDict()  # (width, height, start, end) -> PhotoImage
+
+
+def gradient_image(width, height, start, end):
+    # The gradient only varies left to right, so build one row of pixels and stretch it -
+    # a single PhotoImage replaces the one-canvas-line-per-column version
+    key = (width, height, start, end)
+    photo = _gradient_cache.get(key)
+    if photo is not None:
+        _gradient_cache.move_to_end(key)
+        return photo
+    row = bytearray()
+    for x in range(width):
+        t = x / max(1, (width - 1))
+        row.extend(int(start[i] + (end[i] - start[i]) * t) for i in range(3))
+    img = Image.frombytes("RGB", (width, 1), bytes(row)).resize((width, height), Image.NEAREST)
+    photo = _gradient_cache[key] = ImageTk.PhotoImage(img)
+    while len(_gradient_cache) > GRADIENT_CACHE_SIZE:
+        _gradient_cache.popitem(last=False)
+    return photo
+
+
 def apply_gradient_background(parent, start=(7, 18, 31), end=(12, 32, 54)):
     canvas = tk.Canvas(parent, highlightthickness=0, bd=0)
     canvas.place(relx=0, rely=0, relwidth=1, relheight=1)
     canvas.lower("all")
+    item = canvas.create_image(0, 0, anchor="nw", tags="grad")
+    drawn_size = [None]
 
     def draw(_event=None):
-        canvas.delete("grad")
         w = parent.winfo_width()
         h = parent.winfo_height()
-        if w <= 1 or h <= 1:
-            return
-        for x in range(w):
-            t = x / max(1, (w - 1))
-            r = int(start[0] + (end[0] - start[0]) * t)
-            g = int(start[1] + (end[1] - start[1]) * t)
-            b = int(start[2] + (end[2] - start[2]) * t)
-            canvas.create_line(x, 0, x, h, fill=f"#{r:02x}{g:02x}{b:02x}", tags="grad")
+        if w <= 1 or h <= 1 or (w, h) == drawn_size[0]:
+            return # <Configure> fires on every layout pass, only redraw when the size actually changed
+        drawn_size[0] = (w, h)
+        canvas.gradient = gradient_image(w, h, tuple(start), tuple(end))  # keep a reference or Tk drops the image
+        canvas.itemconfigure(item, image=canvas.gradient)
 
     parent.bind("<Configure>", draw)
     draw()
 
 
+HISTORY_PAGE_SIZE = 50  # messages fetched when a chat opens, and per "load older" page
+CONTACT_SEARCH_DEBOUNCE_MS = 250  # pause in typing before the contact search runs
+SAFETY_REFRESH_MS = 30000  # views are refreshed when something changes, this only catches what the listener can't see
+
+
 def format_timestamp(ts):
     try:
         return datetime.fromtimestamp(float(ts)).strftime("%d %b %H:%M")
@@ -61,9 +99,11 @@ def format_timestamp(ts):
 
 
 class SplashScreen:
-    def __init__(self, root, on_finish):
+    def __init__(self, root, on_finish, warmup=None):
         self.root = root
         self.on_finish = on_finish
+        self.warmup = warmup or WarmUp(dispatch=lambda fn: root.after(0, fn))
+        self.closed = False
 
         self.frame = ctk.CTkFrame(root, fg_color="transparent")
         self.frame.place(relx=0, rely=0, relwidth=1, relheight=1)
@@ -88,9 +128,22 @@ class SplashScreen:
             font=Theme.font(12),
         ).pack(pady=(6, 0))
 
-        self.root.after(1400, self.close)
+        # Runs once the main loop has drawn the window; the splash stays up only as long as warm-up takes
+        self.root.after(0, self.start_warmup)
+
+    def start_warmup(self):
+        self.warmup.mark("window")
+        self.warmup.start(on_done=self.on_warmup_done)
+        self.root.after(int(WARMUP_TIMEOUT * 1000), self.close)
+
+    def on_warmup_done(self):
+        print(f"[RucksApp] {self.warmup.report()}")
+        self.close()
 
     def close(self):
+        if self.closed:
+            return
+        self.closed = True
         self.frame.destroy()
         self.on_finish()
 
@@ -263,6 +316,371 @@ class AuthOverlay:
             self.status_label.configure(text="Registration failed", text_color=Theme.WARN)
 
 
+class BubbleSlot:
+    # One reusable bubble. The virtual list keeps a pool of these and reconfigures them for whichever
+    # message scrolls into view, instead of creating and destroying widgets per message.
+    def __init__(self, canvas, kind):
+        self.kind = kind
+        if kind == "system":
+            self.widget = ctk.CTkLabel(
+                canvas,
+                text="",
+                text_color=Theme.MUTED,
+                fg_color=Theme.SURFACE_ALT,
+                bg_color=Theme.SURFACE,
+                corner_radius=10,
+                font=Theme.font(10),
+                padx=10,
+                pady=6,
+            )
+            self.text = self.widget
+            return
+
+        self.widget = ctk.CTkFrame(canvas, fg_color=Theme.CARD, bg_color=Theme.SURFACE, corner_radius=12)
+        self.sender = ctk.CTkLabel(self.widget, text="", font=Theme.font(9, "bold"), anchor="w", justify="left")
+        self.sender.pack(anchor="w", padx=10, pady=(6, 0))
+        self.text = ctk.CTkLabel(self.widget, text="", font=Theme.font(11), anchor="w", justify="left", wraplength=240)
+        self.text.pack(anchor="w", padx=10, pady=(0, 2))
+        self.stamp = ctk.CTkLabel(self.widget, text="", font=Theme.font(8), anchor="e")
+        self.stamp.pack(anchor="e", padx=10, pady=(0, 6))
+
+    def show(self, entry):
+        self.text.configure(text=entry["text"])
+        if self.kind == "system":
+            return
+        bubble_color = Theme.ACCENT if entry.get("is_own") else Theme.CARD
+        text_color = "#03221e" if entry.get("is_own") else Theme.TEXT
+        self.widget.configure(fg_color=bubble_color)
+        self.sender.configure(text=entry.get("sender_label", ""), text_color=text_color)
+        self.text.configure(text_color=text_color)
+        self.stamp.configure(
+            text=entry.get("stamp", ""),
+            text_color=Theme.WARN if entry.get("warn") else text_color,
+        )
+
+
+def estimate_bubble_height(entry):
+    # Rough height until the row has actually been drawn and measured (~34 chars per line at wraplength 240)
+    if entry["kind"] == "system":
+        return 40
+    lines = sum(max(1, -(-len(line) // 34)) for line in (entry["text"] or " ").split("\n"))
+    return 52 + 17 * lines
+
+
+class VirtualMessageList:
+    # Scrollable list of message bubbles that only has widgets for the rows in view (plus OVERSCAN pixels either side).
+    # Every row has a height (estimated, then measured once drawn) and a y offset; scrolling works out which rows
+    # are visible with a bisect over the offsets and moves pooled BubbleSlots onto them.
+    OVERSCAN = 400
+    ROW_GAP = 8
+    SIDE_PAD = 10
+
+    def __init__(self, parent):
+        self.frame = ctk.CTkFrame(
+            parent,
+            fg_color=Theme.SURFACE,
+            corner_radius=12,
+            border_width=1,
+            border_color=Theme.BORDER,
+        )
+        self.scrollbar = ctk.CTkScrollbar(
+            self.frame,
+            command=self._on_scrollbar,
+            button_color=Theme.CARD,
+            button_hover_color=Theme.CARD_HOVER,
+        )
+        self.scrollbar.pack(side="right", fill="y", padx=(0, 4), pady=6)
+        self.canvas = tk.Canvas(self.frame, bg=Theme.SURFACE, highlightthickness=0, bd=0, yscrollincrement=20)
+        self.canvas.pack(side="left", fill="both", expand=True, padx=(6, 0), pady=6)
+        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+
+        self.keys = []  # row order
+        self.entries = {}
+        self.heights = {}  # key -> height in px, estimated until measured
+        self.measured = set()
+        self.offsets = [0]  # offsets[i] is the top of row i, offsets[-1] the total height
+        self.live = {}  # key -> (slot, canvas item) for rows that currently have widgets
+        self.pool = {"message": [], "system": []}
+
+        self._layout_dirty = False
+        self._render_scheduled = False
+        self._stick_to_bottom = False
+        self._was_at_bottom = False
+        self._anchor = None  # (key, offset within the viewport) to hold still while rows are added above it
+        self.on_reach_top = None  # called when the user scrolls to the very top (loads older history)
+
+        self.canvas.bind("<Configure>", lambda _e: self.schedule_render(relayout=True))
+        # Added alongside the global wheel bindings CTkScrollableFrame makes, never replacing them;
+        # _on_wheel ignores events that aren't over this list
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind_all(sequence, self._on_wheel, add="+")
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    # --------- Model updates (from ConversationView) ---------
+    def insert(self, idx, key, entry):
+        self.keys.insert(idx, key)
+        self.entries[key] = entry
+        self.heights[key] = estimate_bubble_height(entry)
+        self.schedule_render(relayout=True)
+
+    def update(self, key, entry):
+        self.entries[key] = entry
+        self.measured.discard(key)  # text may have changed length, measure again once it's drawn
+        if key in self.live:
+            self.live[key][0].show(entry)
+        else:
+            self.heights[key] = estimate_bubble_height(entry)
+        self.schedule_render(relayout=True)
+
+    def remove(self, idx, key):
+        del self.keys[idx]
+        self.entries.pop(key, None)
+        self.heights.pop(key, None)
+        self.measured.discard(key)
+        self._release(key)
+        self.schedule_render(relayout=True)
+
+    def clear(self):
+        for key in list(self.live):
+            self._release(key)
+        self.keys = []
+        self.entries = {}
+        self.heights = {}
+        self.measured = set()
+        self.schedule_render(relayout=True)
+
+    def scroll_to_bottom(self):
+        self._stick_to_bottom = True
+        self.schedule_render()
+
+    def hold_position(self):
+        # Call before prepending older rows, so the row the user is looking at doesn't jump
+        if self._layout_dirty:
+            self._relayout()
+            self._layout_dirty = False
+        top = self.canvas.canvasy(0)
+        idx = max(0, bisect.bisect_right(self.offsets, top) - 1)
+        if idx < len(self.keys):
+            self._anchor = (self.keys[idx], top - self.offsets[idx])
+
+    # --------- Rendering ---------
+    def schedule_render(self, relayout=False):
+        # Any number of inserts / updates in one Tk callback end up as a single layout pass
+        self._layout_dirty = self._layout_dirty or relayout
+        if not self._render_scheduled:
+            self._render_scheduled = True
+            self.canvas.after_idle(self._render)
+
+    def _relayout(self):
+        self.offsets = [0, *itertools.accumulate(self.heights[k] for k in self.keys)]
+        width = self.canvas.winfo_width()
+        self.canvas.configure(scrollregion=(0, 0, width, max(self.offsets[-1], self.canvas.winfo_height())))
+
+    def _render(self):
+        self._render_scheduled = False
+        if self._layout_dirty:
+            self._relayout()
+            self._layout_dirty = False
+        if self._anchor is not None:
+            self._restore_anchor()
+        if self._stick_to_bottom:
+            self.canvas.yview_moveto(1.0)
+            self._stick_to_bottom = False
+
+        # Measuring can change heights, which moves rows - two passes is enough for it to settle
+        for _ in range(2):
+            top = self.canvas.canvasy(0) - self.OVERSCAN
+            bottom = self.canvas.canvasy(0) + self.canvas.winfo_height() + self.OVERSCAN
+            lo = max(0, bisect.bisect_right(self.offsets, top) - 1)
+            hi = min(len(self.keys), bisect.bisect_left(self.offsets, bottom))
+            visible = self.keys[lo:hi]
+            visible_keys = set(visible)
+
+            for key in [k for k in self.live if k not in visible_keys]:
+                self._release(key)
+            for idx, key in enumerate(visible, start=lo):
+                self._place(idx, key)
+
+            if not self._measure(visible):
+                break
+            self._relayout()
+            if self._was_at_bottom:
+                self.canvas.yview_moveto(1.0)
+
+    def _restore_anchor(self):
+        key, delta = self._anchor
+        self._anchor = None
+        if key not in self.entries or self.offsets[-1] <= 0:
+            return
+        y = self.offsets[self.keys.index(key)] + delta
+        self.canvas.yview_moveto(y / max(self.offsets[-1], self.canvas.winfo_height()))
+
+    def _place(self, idx, key):
+        entry = self.entries[key]
+        width = self.canvas.winfo_width()
+        if entry["kind"] == "system":
+            x, anchor = width // 2, "n"
+        elif entry.get("is_own"):
+            x, anchor = width - self.SIDE_PAD, "ne"
+        else:
+            x, anchor = self.SIDE_PAD, "nw"
+        y = self.offsets[idx] + self.ROW_GAP // 2
+
+        if key in self.live:
+            slot, item = self.live[key]
+            self.canvas.coords(item, x, y)
+            self.canvas.itemconfigure(item, anchor=anchor)
+            return
+
+        pool = self.pool[entry["kind"] if entry["kind"] == "system" else "message"]
+        slot = pool.pop() if pool else BubbleSlot(self.canvas, entry["kind"])
+        slot.show(entry)
+        item = self.canvas.create_window(x, y, window=slot.widget, anchor=anchor)
+        self.live[key] = (slot, item)
+
+    def _release(self, key):
+        live = self.live.pop(key, None)
+        if live is None:
+            return
+        slot, item = live
+        self.canvas.delete(item)  # unmaps the widget but keeps it for reuse
+        self.pool[slot.kind if slot.kind == "system" else "message"].append(slot)
+
+    def _measure(self, keys):
+        pending = [k for k in keys if k not in self.measured and k in self.live]
+        if not pending:
+            return False
+        self._was_at_bottom = self.canvas.yview()[1] >= 0.999
+        self.canvas.update_idletasks()
+        changed = False
+        for key in pending:
+            height = self.live[key][0].widget.winfo_reqheight() + self.ROW_GAP
+            self.measured.add(key)
+            if height != self.heights[key]:
+                self.heights[key] = height
+                changed = True
+        return changed
+
+    # --------- Scrolling ---------
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_render()
+        self._check_top()
+
+    def _check_top(self):
+        if self.on_reach_top and self.keys and self.canvas.yview()[0] <= 0.0:
+            self.on_reach_top()
+
+    def _over_list(self, event):
+        hovered = self.canvas.winfo_containing(event.x_root, event.y_root)
+        return hovered is not None and str(hovered).startswith(str(self.canvas))
+
+    def _on_wheel(self, event):
+        if not self.canvas.winfo_exists() or not self._over_list(event):
+            return
+        if event.num == 4:
+            step = -1
+        elif event.num == 5:
+            step = 1
+        else:
+            step = -1 if event.delta > 0 else 1
+        self.canvas.yview_scroll(step * 2, "units")
+        self.schedule_render()
+        if step < 0:
+            self._check_top()
+
+
+class ConversationView:
+    # Model of the open conversation, keyed by message push id (pending sends use the push key they'll be written
+    # under, system notices get their own keys). Reloads and incoming messages are diffed against it and only the
+    # rows that were added, changed or removed are passed on to the virtual list that draws them.
+    NOTICE_KEY = "__notice__"
+
+    def __init__(self, message_list):
+        self.list = message_list
+        self.partner = None
+        self.entries = {}  # key -> entry dict
+        self.order = []  # keys in display order
+        self.sort_keys = []  # (timestamp, key) for each key in self.order, kept in step for bisect
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def reset(self, partner=None):
+        self.list.clear()
+        self.partner = partner
+        self.entries = {}
+        self.order = []
+        self.sort_keys = []
+
+    def set_notice(self, text):
+        self.upsert({"key": self.NOTICE_KEY, "kind": "system", "timestamp": -1, "text": text})
+
+    def set_messages(self, entries, since=None, until=None):
+        # Brings the view in line with a snapshot of the thread - the whole thread, or with `since` only the part
+        # from that timestamp on (the newest page), leaving older pages alone. Returns True if anything changed.
+        # The snapshot was fetched on a worker, so the listener (or the echo of our own send) may already have added
+        # messages it doesn't know about - anything newer than `until`, the snapshot's newest message, is kept.
+        incoming = {entry["key"] for entry in entries}
+        stale = [
+            k
+            for k, e in self.entries.items()
+            if e["kind"] == "message"
+            and k not in incoming
+            and (since is None or e["timestamp"] >= since)
+            and (until is None or e["timestamp"] <= until)
+        ]
+        changed = bool(stale)
+        for key in stale:
+            self.remove(key)
+        for entry in entries:
+            changed = self.upsert(entry) or changed
+        return changed
+
+    def upsert(self, entry):
+        key = entry["key"]
+        old = self.entries.get(key)
+        if old == entry:
+            return False
+        if entry["kind"] == "message" and self.NOTICE_KEY in self.entries:
+            self.remove(self.NOTICE_KEY)  # first real message replaces "No messages yet."
+
+        if old is not None and old["timestamp"] == entry["timestamp"]:
+            self.entries[key] = entry
+            self.list.update(key, entry)  # same slot, just new text / stamp / colour
+            return True
+
+        if old is not None:
+            self.remove(key)
+        sort_key = (entry["timestamp"], key)
+        idx = bisect.bisect(self.sort_keys, sort_key)
+        self.sort_keys.insert(idx, sort_key)
+        self.order.insert(idx, key)
+        self.entries[key] = entry
+        self.list.insert(idx, key, entry)
+        return True
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        idx = bisect.bisect_left(self.sort_keys, (entry["timestamp"], key))
+        del self.order[idx]
+        del self.sort_keys[idx]
+        self.list.remove(idx, key)
+
+    def last_key(self):
+        return self.order[-1] if self.order else None
+
+    def oldest_message_timestamp(self):
+        for key in self.order:
+            if self.entries[key]["kind"] == "message":
+                return self.entries[key]["timestamp"]
+        return None
+
+
 class QuantumMessagingGUI:
     def __init__(self, root):
         self.root = root
@@ -274,8 +692,31 @@ class QuantumMessagingGUI:
 
         self.profile_picture_path = ""
         self.profile_photo = None
+        self.profile_image_key = None
         self.chat_icon = None
-        self.avatar_cache = {}
+        # Bounded, backed by pre-resized thumbnails on disk, decoded off the Tk thread
+        self.avatar_cache = ImageCache(dispatch=lambda fn: self.root.after(0, fn))
+        # Every db call goes through here so nothing blocks the Tk thread
+        self.data = DataService(dispatch=lambda fn: self.root.after(0, fn))
+        self.refresh = RefreshScheduler(root)
+        self.refresh.register("previews", self.load_conversation_previews, min_interval=1.0)
+        self.refresh.register("history", self.refresh_open_chat, min_interval=2.0)
+        self.rendered_previews = None  # what the chat list is currently showing
+
+        self.send_queue = SendQueue()
+        self.pending_sends = {}  # push key -> bubble drawn before the server confirmed it
+        self.poll_scheduler = AdaptivePollScheduler()  # listener polls fast while we're chatting, slower when idle
+        self.system_message_count = 0
+        self.history_complete = False  # True once the oldest message of the open chat has been loaded
+        self.unread_counts = {}  # partner uid -> unread count from conversation_index
+        self.incoming_batches = []  # listener messages waiting for the Tk thread
+        self.incoming_lock = threading.Lock()
+        self.incoming_scheduled = False
+        self.contact_cards = {}  # uid -> reusable search result card
+        self.contact_results = None  # (query, results, complete) of the last finished search
+        self.contact_search_after = None
+        self.contact_search_seq = 0
+        self.contact_search_busy = False
 
         self.pages = {}
         self.nav_buttons = {}
@@ -410,16 +851,10 @@ class QuantumMessagingGUI:
         self.chat_subtitle = ctk.CTkLabel(header_text, text="", text_color=Theme.MUTED, font=Theme.font(10))
         self.chat_subtitle.pack(anchor="w")
 
-        self.message_scroll = ctk.CTkScrollableFrame(
-            self.chat_detail_view,
-            fg_color=Theme.SURFACE,
-            corner_radius=12,
-            border_width=1,
-            border_color=Theme.BORDER,
-            scrollbar_button_color=Theme.CARD,
-            scrollbar_button_hover_color=Theme.CARD_HOVER,
-        )
-        self.message_scroll.pack(fill="both", expand=True, padx=12, pady=(0, 8))
+        self.message_list = VirtualMessageList(self.chat_detail_view)
+        self.message_list.pack(fill="both", expand=True, padx=12, pady=(0, 8))
+        self.conversation = ConversationView(self.message_list)
+        self.message_list.on_reach_top = self.load_older_messages
 
         spam_row = ctk.CTkFrame(self.chat_detail_view, fg_color="transparent")
         spam_row.pack(fill="x", padx=12, pady=(0, 4))
@@ -446,11 +881,9 @@ class QuantumMessagingGUI:
         self.message_entry.pack(side="left", fill="x", expand=True)
         self.message_entry.bind("<Return>", lambda _e: self.send_current_message())
 
-        self.chat_icon = self._load_chat_icon()
-        ctk.CTkButton(
+        send_button = ctk.CTkButton(
             compose,
             text="Send",
-            image=self.chat_icon,
             compound="left",
             command=self.send_current_message,
             width=86,
@@ -460,7 +893,9 @@ class QuantumMessagingGUI:
             hover_color=Theme.ACCENT_HOVER,
             text_color="#03221e",
             font=Theme.font(11, "bold"),
-        ).pack(side="left", padx=(8, 0))
+        )
+        send_button.pack(side="left", padx=(8, 0))
+        self._load_chat_icon(send_button)
 
         self.show_chat_list()
         return page
@@ -480,7 +915,7 @@ class QuantumMessagingGUI:
             text_color=Theme.TEXT,
         )
         self.contact_search.pack(fill="x", padx=12, pady=(0, 8))
-        self.contact_search.bind("<KeyRelease>", lambda _e: self.load_contacts())
+        self.contact_search.bind("<KeyRelease>", self.schedule_contact_search)
 
         self.contacts_scroll = ctk.CTkScrollableFrame(
             page,
@@ -492,6 +927,9 @@ class QuantumMessagingGUI:
             scrollbar_button_hover_color=Theme.CARD_HOVER,
         )
         self.contacts_scroll.pack(fill="both", expand=True, padx=12, pady=(0, 12))
+        self.contacts_notice = ctk.CTkLabel(
+            self.contacts_scroll, text="", text_color=Theme.MUTED, font=Theme.font(11)
+        )
         return page
 
     def build_profile_page(self):
@@ -585,7 +1023,10 @@ class QuantumMessagingGUI:
         card.pack(fill="x", padx=12, pady=(0, 10))
 
         self.account_label = ctk.CTkLabel(card, text="Not logged in", text_color=Theme.MUTED, font=Theme.font(11))
-        self.account_label.pack(anchor="w", padx=12, pady=(12, 8))
+        self.account_label.pack(anchor="w", padx=12, pady=(12, 0))
+
+        self.poll_metric_label = ctk.CTkLabel(card, text="", text_color=Theme.MUTED, font=Theme.font(10))
+        self.poll_metric_label.pack(anchor="w", padx=12, pady=(0, 8))
 
         ctk.CTkLabel(card, text="Appearance", text_color=Theme.TEXT, font=Theme.font(12, "bold")).pack(
             anchor="w", padx=12, pady=(0, 4)
@@ -652,8 +1093,10 @@ class QuantumMessagingGUI:
             self.load_contacts()
         elif page_name == "profile":
             self.load_profile()
+        elif page_name == "settings":
+            self.update_poll_metric()
         elif page_name == "chats":
-            self.load_conversation_previews()
+            self.refresh.mark_dirty("previews")
             if self.active_receiver:
                 self.show_chat_detail()
             else:
@@ -662,6 +1105,7 @@ class QuantumMessagingGUI:
     def show_chat_list(self):
         self.chat_detail_view.pack_forget()
         self.chat_list_view.pack(fill="both", expand=True)
+        self.refresh.mark_dirty("previews")  # unread badges are hidden only for the chat that's on screen
         if not self.active_receiver:
             self.chat_title.configure(text="Chat")
             self.chat_subtitle.configure(text="")
@@ -675,32 +1119,45 @@ class QuantumMessagingGUI:
     def show_chat_detail(self):
         self.chat_list_view.pack_forget()
         self.chat_detail_view.pack(fill="both", expand=True)
+        partner = self.conversation.partner
+        if partner and self.unread_counts.get(partner):
+            self.unread_counts[partner] = 0
+            self.mark_read(partner)  # it's on screen now
+        self.refresh.mark_dirty("previews")
+
+    def chat_on_screen(self):
+        # The partner whose chat is actually showing, None while the chat list or another page is up
+        if self.conversation.partner and self.chat_detail_view.winfo_viewable():
+            return self.conversation.partner
+        return None
 
     # --------- Login transition ---------
     def init_after_login(self, uid):
         self.uid = uid
-        user = self.get_user_record(uid)
-        email = (user or {}).get("email", "")
-        self.account_label.configure(text=f"Logged in: {email or (uid[:12] + '...')}")
-        self.refresh_user_map()
+        self.account_label.configure(text=f"Logged in: {uid[:12] + '...'}")
+        self.data.submit("account", lambda: self.get_user_record(uid), self.show_account)
+        # Sending needs our own key before anything reaches the outbox, so have it cached before the first send
+        self.data.submit("own_key", lambda: key_cache.get_symmetric_key(uid))
+        self.refresh_user_map(on_done=lambda: contact_search.seed(directory.all()))
         self.load_contacts()
-        self.load_conversation_previews()
+        self.refresh.mark_dirty("previews")
         self.start_listener_once()
         self.start_periodic_refresh()
 
-    def get_user_record(self, uid):
-        from user_auth.firebase_config import db
+    def show_account(self, user):
+        email = (user or {}).get("email", "")
+        if email:
+            self.account_label.configure(text=f"Logged in: {email}")
 
+    def get_user_record(self, uid, fetch=True):
+        # fetch=False never touches the network, use that on the Tk thread
         try:
-            record = db.child("users").child(uid).get()
-            if record and record.val():
-                return record.val()
+            return directory.get(uid, fetch=fetch)
         except Exception:
             return None
-        return None
 
     def get_user_display_meta(self, uid, user_data=None):
-        data = user_data or self.get_user_record(uid) or {}
+        data = user_data if user_data is not None else (self.get_user_record(uid) or {})
         email = (data.get("email") or "").strip()
         first_name = (data.get("first_name") or "").strip()
         display_name = (data.get("display_name") or "").strip() or email or "Unknown User"
@@ -715,158 +1172,197 @@ class QuantumMessagingGUI:
         }
 
     def get_avatar_image(self, picture_path, size):
-        if not picture_path or not os.path.exists(picture_path):
-            return None
-        key = (picture_path, size)
-        cached = self.avatar_cache.get(key)
-        if cached is not None:
-            return cached
-        try:
-            img = Image.open(picture_path)
-            avatar = ctk.CTkImage(light_image=img, dark_image=img, size=(size, size))
-            self.avatar_cache[key] = avatar
-            return avatar
-        except Exception:
-            return None
+        return self.avatar_cache.peek(picture_path, size)
 
     def make_avatar_label(self, parent, user_meta, size=34):
-        avatar_image = self.get_avatar_image(user_meta.get("profile_picture", ""), size)
+        label = ctk.CTkLabel(parent, text="", width=size, height=size, corner_radius=size // 2)
+        self.configure_avatar_label(label, user_meta, size)
+        return label
+
+    def set_chat_header_avatar(self, partner_uid):
+        meta = self.get_user_display_meta(partner_uid, self.get_user_record(partner_uid, fetch=False) or {})
+        self.configure_avatar_label(self.chat_avatar_label, meta, 30)
+
+    def configure_avatar_label(self, label, user_meta, size):
+        # Shows the initial straight away and swaps the photo in once the decode pool has it
+        picture_path = user_meta.get("profile_picture", "")
+        label.avatar_key = (picture_path, size)  # labels get reused, a late decode for an old picture is ignored
+        avatar_image = self.get_avatar_image(picture_path, size)
         if avatar_image is not None:
-            return ctk.CTkLabel(
-                parent,
-                text="",
-                image=avatar_image,
-                width=size,
-                height=size,
-                corner_radius=size // 2,
-                fg_color=Theme.CARD,
-            )
-        return ctk.CTkLabel(
-            parent,
+            label.configure(text="", image=avatar_image, fg_color=Theme.CARD)
+            return
+        label.configure(
+            image=None,
             text=(user_meta.get("initial") or "?")[:1].upper(),
-            width=size,
-            height=size,
-            corner_radius=size // 2,
             fg_color=Theme.SURFACE_ALT,
             text_color=Theme.TEXT,
             font=Theme.font(max(10, size // 2), "bold"),
         )
+        if picture_path:
+            self.avatar_cache.request(picture_path, size, lambda image: self.show_avatar(label, (picture_path, size), image))
 
-    def set_chat_header_avatar(self, partner_uid):
-        meta = self.get_user_display_meta(partner_uid)
-        avatar_image = self.get_avatar_image(meta["profile_picture"], 30)
-        if avatar_image is not None:
-            self.chat_avatar_label.configure(text="", image=avatar_image, fg_color=Theme.CARD)
-        else:
-            self.chat_avatar_label.configure(
-                image=None,
-                text=meta["initial"],
-                fg_color=Theme.SURFACE_ALT,
-                text_color=Theme.TEXT,
-            )
+    def show_avatar(self, label, key, image):
+        if image is None or not label.winfo_exists() or getattr(label, "avatar_key", None) != key:
+            return
+        label.configure(text="", image=image, fg_color=Theme.CARD)
 
     # --------- Data loading ---------
-    def refresh_user_map(self):
-        from user_auth.firebase_config import db
-
-        self.user_map = {}
-        try:
-            users = db.child("users").get()
-            if users and users.val():
-                for user in users.each():
-                    data = user.val() or {}
-                    self.user_map[user.key()] = data.get("display_name", data.get("email", "Unknown User"))
-        except Exception:
-            pass
+    def refresh_user_map(self, force=False, on_done=None):
+        # Incremental - after the first load only users updated since the last refresh are fetched
+        def done(_changed=None):
+            self.apply_user_map()
+            if on_done is not None:
+                on_done()
+
+        self.data.submit("users", lambda: directory.refresh(force=force), done, on_error=lambda _exc: done())
+
+    def apply_user_map(self):
+        self.user_map = {
+            uid: data.get("display_name", data.get("email", "Unknown User")) for uid, data in directory.all().items()
+        }
 
     def load_contacts(self):
-        from user_auth.firebase_config import db
-
-        for widget in self.contacts_scroll.winfo_children():
-            widget.destroy()
+        # Runs the search right away (refresh button, page switch); typing goes through schedule_contact_search
+        if self.contact_search_after is not None:
+            self.root.after_cancel(self.contact_search_after)
+            self.contact_search_after = None
+        self.contact_results = None
+        self.run_contact_search()
+
+    def schedule_contact_search(self, _event=None):
+        # Debounced - only the query the user pauses on is searched, not one per keystroke
+        if self.contact_search_after is not None:
+            self.root.after_cancel(self.contact_search_after)
+        self.contact_search_after = self.root.after(CONTACT_SEARCH_DEBOUNCE_MS, self.run_contact_search)
+
+    def run_contact_search(self):
+        self.contact_search_after = None
+        self.contact_search_seq += 1
 
         if not self.uid:
-            ctk.CTkLabel(self.contacts_scroll, text="Please log in first.", text_color=Theme.MUTED).pack(pady=12)
+            self.show_contacts([], "Please log in first.")
             return
 
         query = self.contact_search.get().strip().lower() if hasattr(self, "contact_search") else ""
         if not query:
-            ctk.CTkLabel(
-                self.contacts_scroll,
-                text="Search by email to find a contact.",
-                text_color=Theme.MUTED,
-                font=Theme.font(11),
-            ).pack(pady=14)
+            self.show_contacts([], "Search by email to find a contact.")
             return
 
-        try:
-            users = db.child("users").get()
-        except Exception:
-            users = None
-
-        if not users or not users.val():
-            ctk.CTkLabel(self.contacts_scroll, text="No contacts found.", text_color=Theme.MUTED).pack(pady=12)
+        reused = self.reuse_contact_results(query)
+        if reused is not None:
+            self.show_contacts(reused, "No account found for that email.")
             return
 
-        shown = 0
-        for user in users.each():
-            partner_uid = user.key()
-            if partner_uid == self.uid:
-                continue
+        # Whatever the trie already knows is shown straight away, the server answer replaces it when it lands
+        self.show_contacts(contact_search.local(query), "Searching...")
+        if self.contact_search_busy:
+            return  # one query in flight at a time, it picks up the newest query when it finishes
+        self.contact_search_busy = True
+        seq = self.contact_search_seq
 
-            data = user.val() or {}
-            email = data.get("email", "").strip()
-            if not email or query not in email.lower():
-                continue
+        def search():
+            try:
+                return contact_search.remote(query), True
+            except Exception as exc:
+                print("Contact search error:", exc)
+                return contact_search.local(query), False
 
-            display_name = data.get("display_name", email)
-            status = data.get("status", "No status set")
+        self.data.submit("contacts", search, lambda found: self.on_contact_results(query, seq, *found))
 
-            self.user_map[partner_uid] = display_name
-            meta = self.get_user_display_meta(partner_uid, data)
+    def reuse_contact_results(self, query):
+        # If the last search came back with fewer than the limit it had every match for its prefix,
+        # so any longer query starting with it can be answered by filtering those results locally
+        if self.contact_results is None:
+            return None
+        prev_query, results, complete = self.contact_results
+        if query == prev_query:
+            return results
+        if not complete or not query.startswith(prev_query) or len(results) >= contact_search.limit:
+            return None
+        return [
+            (uid, data) for uid, data in results
+            if (data.get("email_lower") or data.get("email") or "").lower().startswith(query)
+        ]
 
-            card = ctk.CTkFrame(
-                self.contacts_scroll,
-                fg_color=Theme.CARD,
-                corner_radius=11,
-                border_width=1,
-                border_color=Theme.BORDER,
-            )
-            card.pack(fill="x", padx=6, pady=5)
+    def on_contact_results(self, query, seq, results, complete):
+        self.contact_search_busy = False
+        self.contact_results = (query, results, complete)
+        if seq != self.contact_search_seq:
+            self.run_contact_search()  # stale - the user kept typing, go again with what's in the box now
+            return
+        self.show_contacts(results, "No account found for that email.")
 
-            top_row = ctk.CTkFrame(card, fg_color="transparent")
-            top_row.pack(fill="x", padx=10, pady=(8, 4))
+    def show_contacts(self, results, empty_text):
+        # Cards are kept per uid and only repacked, so a keystroke doesn't tear down and rebuild every widget
+        shown = []
+        for partner_uid, data in results:
+            if partner_uid == self.uid or not (data.get("email") or "").strip():
+                continue
+            self.user_map[partner_uid] = data.get("display_name", data.get("email"))
+            card = self.contact_cards.get(partner_uid)
+            if card is None:
+                card = self.contact_cards[partner_uid] = self.build_contact_card(partner_uid)
+            self.fill_contact_card(card, partner_uid, data)
+            shown.append(card)
+
+        for card in self.contact_cards.values():
+            card["frame"].pack_forget()
+        self.contacts_notice.pack_forget()
+        for card in shown:
+            card["frame"].pack(fill="x", padx=6, pady=5)
+        if not shown:
+            self.contacts_notice.configure(text=empty_text)
+            self.contacts_notice.pack(pady=14)
+
+    def build_contact_card(self, partner_uid):
+        card = ctk.CTkFrame(
+            self.contacts_scroll,
+            fg_color=Theme.CARD,
+            corner_radius=11,
+            border_width=1,
+            border_color=Theme.BORDER,
+        )
 
-            avatar = self.make_avatar_label(top_row, meta, size=34)
-            avatar.pack(side="left")
+        top_row = ctk.CTkFrame(card, fg_color="transparent")
+        top_row.pack(fill="x", padx=10, pady=(8, 4))
 
-            text_col = ctk.CTkFrame(top_row, fg_color="transparent")
-            text_col.pack(side="left", fill="x", expand=True, padx=(8, 0))
+        avatar = ctk.CTkLabel(top_row, text="", width=34, height=34, corner_radius=17)
+        avatar.pack(side="left")
 
-            ctk.CTkLabel(
-                text_col, text=display_name, text_color=Theme.TEXT, font=Theme.font(12, "bold"), anchor="w"
-            ).pack(fill="x")
-            ctk.CTkLabel(text_col, text=email, text_color=Theme.MUTED, font=Theme.font(10), anchor="w").pack(fill="x")
-            ctk.CTkLabel(text_col, text=status, text_color=Theme.MUTED, font=Theme.font(10), anchor="w").pack(fill="x")
+        text_col = ctk.CTkFrame(top_row, fg_color="transparent")
+        text_col.pack(side="left", fill="x", expand=True, padx=(8, 0))
 
-            ctk.CTkButton(
-                card,
-                text="Message",
-                command=lambda u=partner_uid: self.open_conversation(u),
-                fg_color=Theme.SURFACE_ALT,
-                hover_color=Theme.CARD_HOVER,
-                text_color=Theme.TEXT,
-                corner_radius=9,
-                height=28,
-                width=86,
-                font=Theme.font(10, "bold"),
-            ).pack(anchor="e", padx=10, pady=(0, 8))
-            shown += 1
+        name = ctk.CTkLabel(text_col, text="", text_color=Theme.TEXT, font=Theme.font(12, "bold"), anchor="w")
+        name.pack(fill="x")
+        email = ctk.CTkLabel(text_col, text="", text_color=Theme.MUTED, font=Theme.font(10), anchor="w")
+        email.pack(fill="x")
+        status = ctk.CTkLabel(text_col, text="", text_color=Theme.MUTED, font=Theme.font(10), anchor="w")
+        status.pack(fill="x")
 
-        if shown == 0:
-            ctk.CTkLabel(self.contacts_scroll, text="No account found for that email.", text_color=Theme.MUTED).pack(
-                pady=12
-            )
+        ctk.CTkButton(
+            card,
+            text="Message",
+            command=lambda u=partner_uid: self.open_conversation(u),
+            fg_color=Theme.SURFACE_ALT,
+            hover_color=Theme.CARD_HOVER,
+            text_color=Theme.TEXT,
+            corner_radius=9,
+            height=28,
+            width=86,
+            font=Theme.font(10, "bold"),
+        ).pack(anchor="e", padx=10, pady=(0, 8))
+        return {"frame": card, "avatar": avatar, "name": name, "email": email, "status": status, "data": None}
+
+    def fill_contact_card(self, card, partner_uid, data):
+        if card["data"] == data:
+            return  # unchanged since it was last shown
+        card["data"] = data
+        email = data.get("email", "").strip()
+        meta = self.get_user_display_meta(partner_uid, data)
+        card["name"].configure(text=data.get("display_name", email))
+        card["email"].configure(text=email)
+        card["status"].configure(text=data.get("status", "No status set"))
+        self.configure_avatar_label(card["avatar"], meta, 34)
 
     def open_conversation(self, partner_uid):
         self.active_receiver = partner_uid
@@ -874,64 +1370,74 @@ class QuantumMessagingGUI:
         self.chat_title.configure(text=self.active_receiver_name)
         self.chat_subtitle.configure(text=f"ID: {partner_uid[:10]}...")
         self.set_chat_header_avatar(partner_uid)
+        self.poll_scheduler.record_activity()
         self.show_page("chats")
         self.load_chat_history(partner_uid)
         self.show_chat_detail()
 
-    def load_conversation_previews(self):
-        from user_auth.firebase_config import db
-
-        for widget in self.chat_preview_frame.winfo_children():
-            widget.destroy()
+    def mark_read(self, partner_uid):
+        uid = self.uid
+        self.data.submit(f"read/{partner_uid}", lambda: fanout.mark_conversation_read(uid, partner_uid))
 
+    def load_conversation_previews(self):
         if not self.uid:
-            ctk.CTkLabel(self.chat_preview_frame, text="Login to view chats", text_color=Theme.MUTED).pack(pady=12)
+            self.show_conversation_previews(None)
             return
+        self.data.submit("previews", self.fetch_conversation_previews, self.show_conversation_previews)
 
-        self.refresh_user_map()
-        user_data_map = {}
+    def fetch_conversation_previews(self):
+        # Runs on a data service worker: reads the index, decrypts the snippets and looks up names off the Tk thread
         try:
-            users = db.child("users").get()
-            if users and users.val():
-                for user in users.each():
-                    user_data_map[user.key()] = user.val() or {}
+            directory.refresh()
         except Exception:
-            user_data_map = {}
+            pass
 
+        # conversation_index/<uid> is kept up to date by every send, one small node per conversation
         try:
-            chats = db.child("user_messages").child(self.uid).get()
+            index = fanout.load_conversation_index(self.uid)  # backfills threads from before the index existed
         except Exception:
-            chats = None
+            index = {}
 
-        if not chats or not chats.val():
+        previews = []
+        for partner_uid, latest in index.items():
+            if not isinstance(latest, dict) or latest.get("message") is None:
+                continue
+            previews.append(
+                {
+                    "timestamp": latest.get("timestamp", 0),
+                    "partner": partner_uid,
+                    "snippet": self.decrypt_for_preview(latest.get("message", ""), latest.get("sender", "")),
+                    "unread": latest.get("unread", 0) or 0,
+                    "meta": self.get_user_display_meta(partner_uid),
+                }
+            )
+        previews.sort(key=lambda x: x["timestamp"], reverse=True)
+        return previews
+
+    def show_conversation_previews(self, previews):
+        if previews is not None:
+            self.apply_user_map()
+            self.unread_counts = {p["partner"]: p["unread"] for p in previews}
+        on_screen = self.chat_on_screen()
+        state = (previews, on_screen)  # the chat on screen doesn't get an unread badge
+        if state == self.rendered_previews:
+            return  # nothing changed since the last refresh, leave the cards alone
+        self.rendered_previews = state
+
+        for widget in self.chat_preview_frame.winfo_children():
+            widget.destroy()
+
+        if previews is None:
+            ctk.CTkLabel(self.chat_preview_frame, text="Login to view chats", text_color=Theme.MUTED).pack(pady=12)
+            return
+
+        if not previews:
             ctk.CTkLabel(self.chat_preview_frame, text="No conversations yet", text_color=Theme.MUTED).pack(pady=12)
             return
 
-        previews = []
-        for partner_uid, thread in chats.val().items():
-            if not isinstance(thread, dict):
-                continue
-            latest = None
-            for _msg_id, data in thread.items():
-                ts = (data or {}).get("timestamp", 0)
-                if latest is None or ts > latest.get("timestamp", 0):
-                    latest = data
-            if latest:
-                previews.append(
-                    (
-                        latest.get("timestamp", 0),
-                        partner_uid,
-                        latest.get("message", ""),
-                        latest.get("sender", ""),
-                    )
-                )
-
-        previews.sort(key=lambda x: x[0], reverse=True)
-
-        for ts, partner_uid, enc_msg, sender_uid in previews:
-            snippet = self.decrypt_for_preview(enc_msg, sender_uid)
-            user_data = user_data_map.get(partner_uid, {})
-            meta = self.get_user_display_meta(partner_uid, user_data)
+        for preview in previews:
+            ts, partner_uid, snippet, unread = preview["timestamp"], preview["partner"], preview["snippet"], preview["unread"]
+            meta = preview["meta"]
             name = meta["display_name"]
 
             card = ctk.CTkFrame(
@@ -958,8 +1464,15 @@ class QuantumMessagingGUI:
             ctk.CTkLabel(text_col, text=snippet, text_color=Theme.MUTED, font=Theme.font(10), anchor="w").pack(
                 fill="x"
             )
+            stamp = format_timestamp(ts)
+            if unread and partner_uid != on_screen:
+                stamp = f"{stamp}  -  {unread} new"
             ctk.CTkLabel(
-                text_col, text=format_timestamp(ts), text_color=Theme.MUTED, font=Theme.font(9), anchor="w"
+                text_col,
+                text=stamp,
+                text_color=Theme.ACCENT if unread and partner_uid != on_screen else Theme.MUTED,
+                font=Theme.font(9),
+                anchor="w",
             ).pack(fill="x")
 
             ctk.CTkButton(
@@ -980,133 +1493,162 @@ class QuantumMessagingGUI:
             return ""
         try:
             key_owner = sender_uid or self.uid
-            key = send_message.grab_symmetric_key(key_owner)
+            key = key_cache.get_symmetric_key(key_owner)
             text = send_message.decrypt_message(encrypted.encode(), key)
             return text[:36] + ("..." if len(text) > 36 else "")
         except Exception:
             return "[Encrypted message]"
 
-    def clear_message_bubbles(self):
-        for widget in self.message_scroll.winfo_children():
-            widget.destroy()
-
     def scroll_messages_to_bottom(self):
-        self.root.update_idletasks()
-        if hasattr(self.message_scroll, "_parent_canvas"):
-            self.message_scroll._parent_canvas.yview_moveto(1.0)
-
-    def add_message_bubble(self, sender_label, text, stamp="", is_own=False, is_system=False):
-        row = ctk.CTkFrame(self.message_scroll, fg_color="transparent")
-        row.pack(fill="x", padx=8, pady=4)
-
-        if is_system:
-            bubble = ctk.CTkLabel(
-                row,
-                text=text,
-                text_color=Theme.MUTED,
-                fg_color=Theme.SURFACE_ALT,
-                corner_radius=10,
-                font=Theme.font(10),
-                padx=10,
-                pady=6,
-            )
-            bubble.pack(anchor="center")
-            return
+        self.message_list.scroll_to_bottom()
 
-        bubble_color = Theme.ACCENT if is_own else Theme.CARD
-        text_color = "#03221e" if is_own else Theme.TEXT
+    def message_entry_for(self, msg_id, data, text):
+        is_own = data.get("sender") == self.uid
+        return {
+            "key": msg_id,
+            "kind": "message",
+            "timestamp": data.get("timestamp", 0),
+            "sender_label": "You" if is_own else (self.active_receiver_name or "Contact"),
+            "text": text if text is not None else "[Decryption failed]",
+            "stamp": format_timestamp(data.get("timestamp", 0)),
+            "is_own": is_own,
+        }
 
-        bubble = ctk.CTkFrame(row, fg_color=bubble_color, corner_radius=12)
-        bubble.pack(anchor="e" if is_own else "w")
+    def pending_entry_for(self, push_key, pending):
+        return {
+            "key": push_key,
+            "kind": "message",
+            "timestamp": pending["timestamp"],
+            "sender_label": "You",
+            "text": pending["text"],
+            "stamp": self.pending_stamp_text(pending),
+            "is_own": True,
+            "warn": pending["state"] == "failed",
+        }
 
-        ctk.CTkLabel(
-            bubble,
-            text=sender_label,
-            text_color=text_color,
-            font=Theme.font(9, "bold"),
-            anchor="w",
-            justify="left",
-        ).pack(anchor="w", padx=10, pady=(6, 0))
+    def fetch_history_page(self, other_uid, end_at=None):
+        # Newest HISTORY_PAGE_SIZE messages, or with end_at the page ending at that timestamp (inclusive, so one
+        # extra is asked for to make up for the boundary message we already have). Uses the timestamp index.
+        from user_auth.firebase_config import db
 
-        ctk.CTkLabel(
-            bubble,
-            text=text,
-            text_color=text_color,
-            font=Theme.font(11),
-            anchor="w",
-            justify="left",
-            wraplength=240,
-        ).pack(anchor="w", padx=10, pady=(0, 2))
+        query = db.child("user_messages").child(self.uid).child(other_uid).order_by_child("timestamp")
+        if end_at is not None:
+            query = query.end_at(end_at)
+        result = query.limit_to_last(HISTORY_PAGE_SIZE + (1 if end_at is not None else 0)).get()
+        page = []
+        for item in (result.each() or []) if result else []:
+            data = item.val()
+            if isinstance(data, dict) and all(k in data for k in ("sender", "message", "timestamp")):
+                page.append((item.key(), data))
+        return page
 
-        if stamp:
-            ctk.CTkLabel(
-                bubble,
-                text=stamp,
-                text_color=text_color,
-                font=Theme.font(8),
-                anchor="e",
-            ).pack(anchor="e", padx=10, pady=(0, 6))
+    def history_entries(self, page):
+        texts = send_message.decrypt_envelopes([data for _k, data in page])  # one key lookup and cipher per sender
+        return [self.message_entry_for(key, data, text) for (key, data), text in zip(page, texts)]
 
     def load_chat_history(self, other_uid):
-        from user_auth.firebase_config import db
-
-        self.clear_message_bubbles()
+        # Only the newest page is fetched, so opening or refreshing a chat costs the same however long it is.
+        # Older pages come from load_older_messages when the user scrolls to the top.
+        if self.conversation.partner != other_uid:
+            self.conversation.reset(other_uid)
+            self.history_complete = False
+            self.data.cancel("older")
 
         if not self.uid:
-            self.add_message_bubble("", "Please log in first.", is_system=True)
+            self.conversation.set_notice("Please log in first.")
             return
 
-        try:
-            convo = db.child("user_messages").child(self.uid).child(other_uid).get()
-        except Exception:
-            convo = None
+        def fetch():
+            page = self.fetch_history_page(other_uid)
+            return page, self.history_entries(page)
+
+        # A quick switch to another chat supersedes this one, so only the chat on screen is ever drawn.
+        # On failure we keep what's on screen rather than blanking the chat on a network blip.
+        self.data.submit(
+            "history",
+            fetch,
+            lambda result: self.show_chat_history(other_uid, *result),
+            on_error=lambda exc: print("History load error:", exc),
+        )
 
-        if not convo or not convo.val():
-            self.add_message_bubble("", "No messages yet.", is_system=True)
+    def show_chat_history(self, other_uid, page, entries):
+        if self.conversation.partner != other_uid:
             return
+        entries.extend(self.pending_entries(other_uid, {key for key, _data in page}))
 
-        key_cache = {}
+        if len(page) < HISTORY_PAGE_SIZE:
+            self.history_complete = True
+            since = None  # this is the whole thread
+        else:
+            since = page[0][1].get("timestamp", 0)
 
-        def get_key_for_user(user_id):
-            if not user_id:
-                return None
-            if user_id in key_cache:
-                return key_cache[user_id]
-            try:
-                key_cache[user_id] = send_message.grab_symmetric_key(user_id)
-            except Exception:
-                key_cache[user_id] = None
-            return key_cache[user_id]
+        # An empty page has nothing to vouch for, so it doesn't remove anything either
+        until = max((data.get("timestamp", 0) for _key, data in page), default=float("-inf"))
 
-        messages = []
-        for _msg_id, data in convo.val().items():
-            if isinstance(data, dict) and all(k in data for k in ("sender", "message", "timestamp")):
-                messages.append(data)
-
-        messages.sort(key=lambda m: m.get("timestamp", 0))
-
-        for msg in messages:
-            sender_label = "You" if msg.get("sender") == self.uid else (self.active_receiver_name or "Contact")
-            stamp = format_timestamp(msg.get("timestamp", 0))
-
-            text = "[Decryption failed]"
-            sender_uid = msg.get("sender")
-            key = get_key_for_user(sender_uid)
-            if key:
-                try:
-                    text = send_message.decrypt_message(msg.get("message", "").encode(), key)
-                except Exception:
-                    pass
-
-            self.add_message_bubble(
-                sender_label=sender_label,
-                text=text,
-                stamp=stamp,
-                is_own=(msg.get("sender") == self.uid),
-                is_system=False,
-            )
+        last_key = self.conversation.last_key()
+        self.conversation.set_messages(entries, since=since, until=until)
+        if not entries and not self.conversation.order:
+            self.conversation.set_notice("No messages yet.")
+        if self.conversation.last_key() != last_key:
+            self.scroll_messages_to_bottom()  # only jump when something new landed at the bottom
 
-        self.scroll_messages_to_bottom()
+    def load_older_messages(self):
+        if self.history_complete or not self.uid or not self.conversation.partner or self.data.busy("older"):
+            return
+        oldest = self.conversation.oldest_message_timestamp()
+        if oldest is None:
+            return
+
+        partner = self.conversation.partner
+
+        def fetch():
+            page = self.fetch_history_page(partner, end_at=oldest)
+            return page, self.history_entries(page)
+
+        self.data.submit(
+            "older",
+            fetch,
+            lambda result: self.show_older_messages(partner, *result),
+            on_error=lambda exc: print("History load error:", exc),
+        )
+
+    def show_older_messages(self, partner, page, entries):
+        if self.conversation.partner != partner:
+            return
+        if len(page) < HISTORY_PAGE_SIZE + 1:
+            self.history_complete = True
+
+        entries = [entry for entry in entries if entry["key"] not in self.conversation]
+        if not entries:
+            return
+        self.message_list.hold_position()
+        for entry in entries:
+            self.conversation.upsert(entry)
+
+    def pending_entries(self, other_uid, message_ids=()):
+        # Sends the server hasn't shown us yet stay in the view until the copy with the same push key arrives
+        entries = []
+        for push_key, pending in list(self.pending_sends.items()):
+            if push_key in message_ids:
+                del self.pending_sends[push_key]
+            elif pending["receiver"] == other_uid:
+                entries.append(self.pending_entry_for(push_key, pending))
+        return entries
+
+    def pending_stamp_text(self, pending):
+        if pending["state"] == "failed":
+            return "Failed to send"
+        if pending["state"] == "sent":
+            return format_timestamp(pending["timestamp"])
+        if pending["state"] == "retrying":
+            return "Waiting for network..."
+        return "Sending..."
+
+    def refresh_pending_bubble(self, push_key):
+        pending = self.pending_sends.get(push_key)
+        if pending is None or pending["receiver"] != self.conversation.partner:
+            return
+        self.conversation.upsert(self.pending_entry_for(push_key, pending))
 
     # --------- Messaging ---------
     def send_current_message(self):
@@ -1121,24 +1663,73 @@ class QuantumMessagingGUI:
             return
 
         self.message_entry.delete(0, tk.END)
+        self.poll_scheduler.record_activity()  # a reply is likely, so poll fast for a while
+
+        # Draw the bubble straight away, the send queue confirms (or fails) it once the write lands
+        push_key = fanout.new_push_key()
+        receiver = self.active_receiver
+        self.pending_sends[push_key] = {"receiver": receiver, "text": message, "timestamp": time.time(), "state": "pending"}
+        self.refresh_pending_bubble(push_key)
+        self.scroll_messages_to_bottom()
+
+        sender = self.uid
+
+        def job():
+            import spam_detection.main as spam_detection  # loaded during the splash, this waits for it if still training
+
+            spam_prob = float(spam_detection.get_spam_probability(message))
+            self.root.after(0, lambda: self.show_spam_probability(spam_prob))
+            start = time.time()
+            # Only encrypts and writes to the local outbox here, the outbox reports back once the database confirms it
+            send_message.send_message(
+                sender,
+                receiver,
+                message,
+                push_key=push_key,
+                on_delivered=lambda _key: self.root.after(0, lambda: self.on_send_finished(push_key, time.time() - start)),
+                on_retry=lambda _key, attempts, exc: self.root.after(0, lambda: self.on_send_retry(push_key, attempts, exc)),
+                on_failed=lambda _key, exc: self.root.after(0, lambda: self.on_send_finished(push_key, None, exc)),
+            )
+
+        self.send_queue.submit(
+            job,
+            on_failure=lambda exc: self.root.after(0, lambda: self.on_send_finished(push_key, None, exc)),
+        )
 
-        spam_prob = float(spam_detection.get_spam_probability(message))
+    def show_spam_probability(self, spam_prob):
         self.spam_label.configure(text=f"Spam probability: {spam_prob:.3f}")
         self.spam_meter.set(max(0.0, min(1.0, spam_prob)))
 
-        start = time.time()
-        try:
-            send_message.send_message(self.uid, self.active_receiver, message)
-            elapsed = time.time() - start
-            self.show_system_message(f"[RucksApp] Sent in {elapsed:.3f}s")
-        except Exception as exc:
-            self.show_system_message(f"[Error] Send failed: {exc}")
-
-        self.load_chat_history(self.active_receiver)
-        self.load_conversation_previews()
+    def on_send_finished(self, push_key, elapsed, error=None):
+        pending = self.pending_sends.get(push_key)
+        if pending is None:
+            return
+        if error is not None:
+            pending["state"] = "failed"
+            self.refresh_pending_bubble(push_key)
+            if pending["receiver"] == self.active_receiver:
+                self.show_system_message(f"[Error] Send failed: {error}")
+            return
+        pending["state"] = "sent"
+        self.refresh_pending_bubble(push_key)
+        self.refresh.mark_dirty("previews")  # the chat list shows this as the latest message now
+        print(f"[RucksApp] Sent in {elapsed:.3f}s")
+
+    def on_send_retry(self, push_key, attempts, error):
+        # The envelope is safe in the outbox, so this is only a "still trying" state rather than a failure
+        pending = self.pending_sends.get(push_key)
+        if pending is None:
+            return
+        pending["state"] = "retrying"
+        self.refresh_pending_bubble(push_key)
+        if attempts == 1 and pending["receiver"] == self.active_receiver:
+            self.show_system_message(f"[RucksApp] Network problem, will keep retrying: {error}")
 
     def show_system_message(self, text):
-        self.add_message_bubble("", text, is_system=True)
+        self.system_message_count += 1
+        self.conversation.upsert(
+            {"key": f"system-{self.system_message_count}", "kind": "system", "timestamp": time.time(), "text": text}
+        )
         self.scroll_messages_to_bottom()
 
     # --------- Listener and refresh ---------
@@ -1147,27 +1738,74 @@ class QuantumMessagingGUI:
             return
         self.listener_started = True
 
-        def safe_callback(msg):
-            self.root.after(0, lambda: self.on_incoming_message(msg))
-
-        thread = threading.Thread(target=listen_for_messages, args=(self.uid, safe_callback), daemon=True)
+        def safe_callback(batch):
+            # Batches arriving while the Tk thread is busy are merged and applied in one go
+            with self.incoming_lock:
+                self.incoming_batches.extend(batch)
+                if self.incoming_scheduled:
+                    return
+                self.incoming_scheduled = True
+            self.root.after(0, self.apply_incoming_messages)
+
+        thread = threading.Thread(
+            target=listen_for_messages,
+            args=(self.uid, safe_callback),
+            kwargs={"scheduler": self.poll_scheduler, "batched": True},
+            daemon=True,
+        )
         thread.start()
-
-    def on_incoming_message(self, msg):
-        sender = msg.get("sender")
-        if sender == self.active_receiver:
+        self.root.bind("<FocusIn>", lambda _e: self.poll_scheduler.record_activity(), add="+")
+
+    def apply_incoming_messages(self):
+        with self.incoming_lock:
+            batch = self.incoming_batches
+            self.incoming_batches = []
+            self.incoming_scheduled = False
+        if batch:
+            self.on_incoming_messages(batch)
+
+    def on_incoming_messages(self, batch):
+        # One incremental update per batch: only the new bubbles are added to the open chat
+        last_key = self.conversation.last_key()
+        read_partner = None
+        for msg in batch:
+            # Our own sends coming back from the server replace their pending bubble in place (same push key)
+            self.pending_sends.pop(msg.get("id"), None)
+            if msg.get("sender") != self.conversation.partner:
+                continue
+            data = {"sender": msg.get("from"), "timestamp": msg.get("timestamp", 0)}
+            self.conversation.upsert(self.message_entry_for(msg.get("id"), data, msg.get("message")))
+            if msg.get("from") != self.uid:
+                read_partner = msg.get("sender")
+
+        if read_partner and read_partner == self.chat_on_screen():
+            self.mark_read(read_partner)  # it's on screen, so it's not unread
+        if self.conversation.last_key() != last_key:
+            self.scroll_messages_to_bottom()
+        self.refresh.mark_dirty("previews")  # the open chat was already updated in place above
+
+    def refresh_open_chat(self):
+        if self.active_receiver:
             self.load_chat_history(self.active_receiver)
-        self.load_conversation_previews()
 
     def start_periodic_refresh(self):
+        # Safety net only - everything the listener, sends and profile saves change marks its views dirty directly
         def loop():
             if self.uid:
-                self.load_conversation_previews()
-                if self.active_receiver:
-                    self.load_chat_history(self.active_receiver)
-            self.root.after(2000, loop)
+                self.refresh.mark_dirty("previews", "history")
+            self.root.after(SAFETY_REFRESH_MS, loop)
+
+        self.root.after(SAFETY_REFRESH_MS, loop)
 
-        loop()
+    def update_poll_metric(self):
+        metrics = self.poll_scheduler.metrics()
+        if not self.listener_started:
+            text = "Inbox updates: not running"
+        elif metrics["mode"] == "streaming":
+            text = "Inbox updates: live (streaming)"  # the poll interval only applies to the polling fallback
+        else:
+            text = f"Inbox check interval: {metrics['interval']:.0f}s ({metrics['polls']} checks, polling)"
+        self.poll_metric_label.configure(text=text)
 
     # --------- Profile ---------
     def choose_profile_picture(self):
@@ -1181,36 +1819,30 @@ class QuantumMessagingGUI:
         self.update_profile_image(path)
 
     def update_profile_image(self, path, initial="?"):
-        if not path or not os.path.exists(path):
-            self.profile_photo = None
-            self.profile_image_label.configure(
-                text=(initial or "?")[:1].upper(),
-                image=None,
-                text_color=Theme.TEXT,
-                fg_color=Theme.CARD,
-            )
-            return
-        try:
-            img = Image.open(path)
-            self.profile_photo = ctk.CTkImage(light_image=img, dark_image=img, size=(108, 108))
-            self.profile_image_label.configure(text="", image=self.profile_photo)
-        except Exception:
-            self.profile_photo = None
-            self.profile_image_label.configure(
-                text=(initial or "?")[:1].upper(),
-                image=None,
-                text_color=Theme.TEXT,
-                fg_color=Theme.CARD,
-            )
+        self.profile_photo = None
+        self.profile_image_label.configure(
+            text=(initial or "?")[:1].upper(),
+            image=None,
+            text_color=Theme.TEXT,
+            fg_color=Theme.CARD,
+        )
+        self.profile_image_key = path
+        if path:
+            self.avatar_cache.request(path, 108, lambda image: self.show_profile_image(path, image))
 
-    def load_profile(self):
-        from user_auth.firebase_config import db
+    def show_profile_image(self, path, image):
+        if image is None or path != self.profile_image_key:
+            return  # failed, or another picture was chosen while this one decoded
+        self.profile_photo = image
+        self.profile_image_label.configure(text="", image=image)
 
+    def load_profile(self):
         if not self.uid:
             return
+        uid = self.uid
+        self.data.submit("profile", lambda: self.get_user_record(uid), self.show_profile)
 
-        user = self.get_user_record(self.uid)
-
+    def show_profile(self, user):
         if not user:
             return
 
@@ -1225,8 +1857,6 @@ class QuantumMessagingGUI:
         self.update_profile_image(self.profile_picture_path, initial=initial)
 
     def save_profile(self):
-        from user_auth.firebase_config import db
-
         if not self.uid:
             return
 
@@ -1234,37 +1864,53 @@ class QuantumMessagingGUI:
         status = self.status_entry.get().strip()
         profile_initial = (display_name[:1] or "?").upper()
 
-        try:
-            db.child("users").child(self.uid).update(
-                {
-                    "display_name": display_name,
-                    "status": status,
-                    "profile_initial": profile_initial,
-                    "profile_picture": self.profile_picture_path,
-                }
-            )
-            self.profile_status_label.configure(text="Profile saved.", text_color="#22c55e")
-            self.refresh_user_map()
-            self.load_contacts()
-            self.load_conversation_previews()
-        except Exception as exc:
-            self.profile_status_label.configure(text=f"Save failed: {exc}", text_color=Theme.WARN)
+        profile = {
+            "display_name": display_name,
+            "status": status,
+            "profile_initial": profile_initial,
+            "profile_picture": self.profile_picture_path,
+            "updated_at": SERVER_TIMESTAMP,  # lets other clients pick the change up in their incremental refresh
+        }
+        uid = self.uid
+
+        def write():
+            from user_auth.firebase_config import db
+
+            db.child("users").child(uid).update(profile)
+            directory.put(uid, profile)
+
+        self.profile_status_label.configure(text="Saving...", text_color=Theme.MUTED)
+        self.data.submit("profile_save", write, lambda _r: self.on_profile_saved(), on_error=self.on_profile_save_failed)
+
+    def on_profile_saved(self):
+        self.profile_status_label.configure(text="Profile saved.", text_color="#22c55e")
+        self.refresh_user_map()
+        self.load_contacts()
+        self.refresh.mark_dirty("previews")
+
+    def on_profile_save_failed(self, exc):
+        self.profile_status_label.configure(text=f"Save failed: {exc}", text_color=Theme.WARN)
 
     # --------- Utilities ---------
-    def _load_chat_icon(self):
+    def _load_chat_icon(self, button):
         dark = "assets/chat_icon_dark.png"
         light = "assets/chat_icon_light.png"
-        if os.path.exists(dark) and os.path.exists(light):
-            dark_img = Image.open(dark)
-            light_img = Image.open(light)
-            return ctk.CTkImage(dark_image=dark_img, light_image=light_img, size=(15, 15))
-        return None
+
+        def ready(image):
+            if image is not None and button.winfo_exists():
+                self.chat_icon = image
+                button.configure(image=image)
+
+        self.avatar_cache.request_icon(light, dark, 15, ready)
 
     def logout(self):
+        self.data.close()
+        key_cache.invalidate()
         self.root.destroy()
 
 
 if __name__ == "__main__":
+    started_at = time.perf_counter()
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")
 
@@ -1278,5 +1924,5 @@ if __name__ == "__main__":
     def show_login():
         AuthOverlay(app, on_success=gui.init_after_login)
 
-    SplashScreen(app, on_finish=show_login)
+    SplashScreen(app, on_finish=show_login, warmup=WarmUp(dispatch=lambda fn: app.after(0, fn), started_at=started_at))
     app.mainloop()
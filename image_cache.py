@@ -0,0 +1,164 @@
+# Avatar / profile picture cache for the GUI.
+# Source photos are decoded once and saved as small PNG thumbnails under the local profile, named after the file's
+# content hash and the pixel size, so later renders (and later runs) only ever open a tiny file. The CTkImages built
+# from them are kept in a bounded LRU instead of growing forever, and nothing is decoded on the Tk thread.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import customtkinter as ctk
+from PIL import Image, ImageOps
+
+from user_auth.local_profile import profile_path
+
+THUMBNAIL_SIZES = (30, 34, 108)  # chat header, list avatars, profile page
+MAX_CACHED_IMAGES = 128
+DECODE_WORKERS = 2
+
+_digests = {}  # (path, mtime, size) -> sha1 of the file
+
+
+def _file_digest(path):
+    # Hashing reads the whole file, so remember the digest until the file changes
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(memo_key)
+    if digest is None:
+        sha = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                sha.update(chunk)
+        digest = _digests[memo_key] = sha.hexdigest()
+    return digest
+
+
+def thumbnail_path(digest, size):
+    return profile_path("thumbnails", f"{digest}_{size}.png")
+
+
+def _make_thumbnails(source_path, digest, sizes):
+    # One full decode of the source writes every size we use, not just the one asked for
+    with Image.open(source_path) as img:
+        img.draft("RGB", (max(sizes), max(sizes)))  # JPEGs decode straight at a reduced scale
+        img = ImageOps.exif_transpose(img).convert("RGBA")
+        thumbs = {}
+        for size in sizes:
+            thumb = img.resize((size, size), Image.LANCZOS)
+            try:
+                tmp_path = f"{thumbnail_path(digest, size)}.tmp"
+                thumb.save(tmp_path, "PNG")
+                os.replace(tmp_path, thumbnail_path(digest, size))
+            except OSError as exc:
+                print("Could not save thumbnail:", exc)
+            thumbs[size] = thumb
+    return thumbs
+
+
+def load_thumbnail(source_path, size):
+    # Returns a size x size PIL image for the source photo, from the disk cache when we have it
+    digest = _file_digest(source_path)
+    path = thumbnail_path(digest, size)
+    if os.path.exists(path):
+        with Image.open(path) as thumb:
+            thumb.load()
+            return thumb.copy()
+    sizes = sorted(set(THUMBNAIL_SIZES) | {size})
+    return _make_thumbnails(source_path, digest, sizes)[size]
+
+
+def load_icon(light_path, dark_path):
+    images = []
+    for path in (light_path, dark_path):
+        with Image.open(path) as img:
+            img.load()
+            images.append(img.copy())
+    return tuple(images)
+
+
+class ImageCache:
+    # Decoding happens on a small worker pool. request() hands the finished CTkImage to on_ready through
+    # `dispatch` (the GUI passes root.after), so widgets are only ever touched from the Tk thread.
+    def __init__(self, max_size=MAX_CACHED_IMAGES, workers=DECODE_WORKERS, dispatch=None):
+        self.max_size = max_size
+        self.dispatch = dispatch or (lambda fn: fn())
+        self._images = OrderedDict()  # key -> CTkImage, least recently used first
+        self._waiting = {}  # key -> on_ready callbacks for a decode already in flight
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rucksapp-decode")
+
+    def peek(self, picture_path, size):
+        # Memory only, never touches the disk - safe to call while rendering
+        return self._cached((picture_path, size)) if picture_path else None
+
+    def request(self, picture_path, size, on_ready):
+        # on_ready(image) runs right away if the image is cached, otherwise once it's decoded (None if it can't be)
+        if not picture_path:
+            on_ready(None)
+            return
+        self._load((picture_path, size), size, lambda: _square(load_thumbnail(picture_path, size)), on_ready)
+
+    def request_icon(self, light_path, dark_path, size, on_ready):
+        self._load((light_path, dark_path, size), size, lambda: load_icon(light_path, dark_path), on_ready)
+
+    def _cached(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def _load(self, key, size, decode, on_ready):
+        image = self._cached(key)
+        if image is not None:
+            on_ready(image)
+            return
+        with self._lock:
+            if key in self._waiting:
+                self._waiting[key].append(on_ready)  # same image already being decoded for another widget
+                return
+            self._waiting[key] = [on_ready]
+        self._executor.submit(self._decode, key, size, decode)
+
+    def _decode(self, key, size, decode):
+        try:
+            light, dark = decode()
+        except Exception:
+            light = dark = None
+        self.dispatch(lambda: self._finish(key, size, light, dark))
+
+    def _finish(self, key, size, light, dark):
+        image = None
+        if light is not None:
+            image = self.put(key, ctk.CTkImage(light_image=light, dark_image=dark, size=(size, size)))
+        with self._lock:
+            callbacks = self._waiting.pop(key, [])
+        for on_ready in callbacks:
+            try:
+                on_ready(image)
+            except Exception as exc:
+                print("Image callback error:", exc)
+
+    def put(self, key, image):
+        with self._lock:
+            self._images[key] = image
+            self._images.move_to_end(key)
+            while len(self._images) > self.max_size:
+                self._images.popitem(last=False)
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def __len__(self):
+        return len(self._images)
+
+
+def _square(thumb):
+    return thumb, thumb
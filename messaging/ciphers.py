@@ -0,0 +1,51 @@
+# Registry of Fernet cipher objects, one per symmetric key.
+# Building a Fernet decodes and validates the key, so we do it once per key and share the object -
+# Fernet keeps no per-call state, so the same instance is safe to use from several threads.
+
+from functools import lru_cache
+
+from cryptography.fernet import Fernet
+
+MAX_CIPHERS = 256
+
+
+def _as_bytes(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+@lru_cache(maxsize=MAX_CIPHERS)
+def _cipher_for(key_bytes):
+    return Fernet(key_bytes)
+
+
+def get_cipher(symmetric_key):
+    return _cipher_for(_as_bytes(symmetric_key))
+
+
+def encrypt(plaintext, symmetric_key):
+    return get_cipher(symmetric_key).encrypt(plaintext.encode())
+
+
+def decrypt(token, symmetric_key):
+    return get_cipher(symmetric_key).decrypt(_as_bytes(token)).decode()
+
+
+def encrypt_many(plaintexts, symmetric_key):
+    fernet = get_cipher(symmetric_key)
+    return [fernet.encrypt(text.encode()) for text in plaintexts]
+
+
+def decrypt_many(tokens, symmetric_key):
+    # One bad token shouldn't lose the rest of the history, so failures come back as None
+    fernet = get_cipher(symmetric_key)
+    results = []
+    for token in tokens:
+        try:
+            results.append(fernet.decrypt(_as_bytes(token)).decode())
+        except Exception:
+            results.append(None)
+    return results
+
+
+def clear():
+    _cipher_for.cache_clear()
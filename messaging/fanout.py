@@ -0,0 +1,144 @@
+# Multi-path fan-out writer for the realtime database.
+# Every path a message touches is collected into one dict and sent as a single PATCH at the root,
+# so a send costs one round trip and the sender / receiver threads can never end up out of sync.
+
+import time
+
+from user_auth.firebase_config import db
+
+KEEP_GLOBAL_LOG = True  # The global "messages" node is only a debug log, switch off to keep it out of the hot path.
+
+
+def new_push_key():
+    return db.generate_key()  # Same format as push(), generated locally so no round trip is needed.
+
+
+def build_message_data(sender_uuid, receiver_uuid, encrypted_message, timestamp=None):
+    if isinstance(encrypted_message, bytes):
+        encrypted_message = encrypted_message.decode()
+    return {
+        "sender": sender_uuid,
+        "receiver": receiver_uuid,
+        "timestamp": timestamp if timestamp is not None else time.time(),
+        "message": encrypted_message,
+    }
+
+
+INDEX_FIELDS = ("message", "sender", "timestamp", "push_key")
+
+
+def _index_fields(owner_uuid, partner_uuid, message_data, push_key):
+    # conversation_index/<owner>/<partner> holds just the latest envelope of the thread, so the chat list can
+    # read one small node per conversation instead of every message. Written field by field so "unread" survives.
+    base = f"conversation_index/{owner_uuid}/{partner_uuid}"
+    return {
+        f"{base}/message": message_data["message"],
+        f"{base}/sender": message_data["sender"],
+        f"{base}/timestamp": message_data["timestamp"],
+        f"{base}/push_key": push_key,
+    }
+
+
+def _indexed_timestamp(owner_uuid, partner_uuid):
+    stored = db.child("conversation_index").child(owner_uuid).child(partner_uuid).child("timestamp").get()
+    return (stored.val() or 0) if stored else 0
+
+
+class FanoutWriter:
+    def __init__(self, keep_global_log=None):
+        self.keep_global_log = KEEP_GLOBAL_LOG if keep_global_log is None else keep_global_log
+        self.updates = {}
+        self.latest = {}  # (owner, partner) -> timestamp of the newest message indexed in this batch
+        self.unread = {}  # (receiver, sender) -> messages added to the receiver's unread count in this batch
+        self.check_index = set()  # (owner, partner) pairs whose stored index may already be newer than this batch
+
+    def add_message(self, message_data, push_key=None, check_index=False):
+        # check_index=True for envelopes that may be older than what's already indexed (outbox retries and
+        # leftovers from a previous run) - commit() then won't let them replace a newer preview
+        push_key = push_key or new_push_key()
+        sender_uuid = message_data["sender"]
+        receiver_uuid = message_data["receiver"]
+
+        if self.keep_global_log:
+            self.updates[f"messages/{push_key}"] = message_data
+        self.updates[f"user_messages/{sender_uuid}/{receiver_uuid}/{push_key}"] = message_data
+        self.updates[f"user_messages/{receiver_uuid}/{sender_uuid}/{push_key}"] = message_data
+
+        for owner, partner in ((sender_uuid, receiver_uuid), (receiver_uuid, sender_uuid)):
+            if message_data["timestamp"] >= self.latest.get((owner, partner), 0):
+                self.latest[(owner, partner)] = message_data["timestamp"]
+                self.updates.update(_index_fields(owner, partner, message_data, push_key))
+            if check_index:
+                self.check_index.add((owner, partner))
+        if sender_uuid != receiver_uuid:
+            self.updates[f"conversation_index/{sender_uuid}/{receiver_uuid}/unread"] = 0  # replying means it's been read
+            self.unread[(receiver_uuid, sender_uuid)] = self.unread.get((receiver_uuid, sender_uuid), 0) + 1
+        return push_key
+
+    def commit(self):
+        if not self.updates:
+            return
+        for owner, partner in self.check_index:
+            # A read before the write rather than a transaction, so two clients racing can still cross -
+            # but a late retry can no longer roll the preview back to an older message
+            if _indexed_timestamp(owner, partner) > self.latest.get((owner, partner), 0):
+                for field in INDEX_FIELDS:
+                    self.updates.pop(f"conversation_index/{owner}/{partner}/{field}", None)
+        for (receiver_uuid, sender_uuid), count in self.unread.items():
+            # Server-side increment, so concurrent senders can't overwrite each other's counts
+            self.updates[f"conversation_index/{receiver_uuid}/{sender_uuid}/unread"] = {".sv": {"increment": count}}
+        db.update(self.updates)  # One PATCH at the root - either every path is written or none are.
+        self.updates = {}
+        self.latest = {}
+        self.unread = {}
+        self.check_index = set()
+
+    def __len__(self):
+        return len(self.updates)
+
+
+def mark_conversation_read(owner_uuid, partner_uuid):
+    db.child("conversation_index").child(owner_uuid).child(partner_uuid).child("unread").set(0)
+
+
+def backfill_conversation_index(owner_uuid, existing=None):
+    # One-off migration for accounts whose threads predate conversation_index: scans the threads once and indexes
+    # the latest envelope of each, leaving alone anything already indexed with something newer. Sets the
+    # conversation_index_meta/<owner>/backfilled marker so it never runs again, and returns the merged index.
+    existing = dict(existing or {})
+    chats = db.child("user_messages").child(owner_uuid).get()
+    updates = {}
+    for partner_uuid, thread in ((chats.val() or {}) if chats else {}).items():
+        if not isinstance(thread, dict):
+            continue
+        latest_key, latest = None, None
+        for msg_id, data in thread.items():
+            if isinstance(data, dict) and (latest is None or data.get("timestamp", 0) > latest.get("timestamp", 0)):
+                latest_key, latest = msg_id, data
+        if latest is None or latest.get("message") is None:
+            continue
+        current = existing.get(partner_uuid)
+        current = current if isinstance(current, dict) else {}
+        if current.get("timestamp", 0) >= latest.get("timestamp", 0):
+            continue
+        latest = {"message": latest["message"], "sender": latest.get("sender", ""), "timestamp": latest.get("timestamp", 0)}
+        updates.update(_index_fields(owner_uuid, partner_uuid, latest, latest_key))
+        existing[partner_uuid] = dict(latest, push_key=latest_key, unread=current.get("unread", 0))
+    updates[f"conversation_index_meta/{owner_uuid}/backfilled"] = True
+    db.update(updates)
+    return existing
+
+
+_backfilled = set()  # owners whose marker we've already seen this run
+
+
+def load_conversation_index(owner_uuid):
+    # conversation_index/<owner>, backfilled from the old threads the first time any client loads it
+    index = db.child("conversation_index").child(owner_uuid).get()
+    index = (index.val() or {}) if index else {}
+    if owner_uuid not in _backfilled:
+        marker = db.child("conversation_index_meta").child(owner_uuid).child("backfilled").get()
+        if not (marker and marker.val()):
+            index = backfill_conversation_index(owner_uuid, index)
+        _backfilled.add(owner_uuid)
+    return index
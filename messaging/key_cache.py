@@ -0,0 +1,88 @@
+# Process-wide cache for the symmetric keys stored under user_keys/<uid>.
+# Every caller (sending, the listener thread, the GUI previews and history) shares the one cache,
+# so repeat sends and refreshes don't go back to the database for a key we already hold.
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 600  # seconds - keys are only ever rotated by hand, so this can be long
+DEFAULT_MAX_SIZE = 512
+
+
+class KeyCache:
+    def __init__(self, loader=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.loader = loader or _load_from_database
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # uid -> (key, expires_at), oldest first
+        self._lock = threading.Lock()
+        self._inflight = {}  # uid -> Event, so concurrent misses for one uid only fetch once
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid):
+        while True:
+            with self._lock:
+                entry = self._entries.get(uid)
+                if entry is not None and entry[1] > time.monotonic():
+                    self._entries.move_to_end(uid)
+                    self.hits += 1
+                    return entry[0]
+
+                waiting = self._inflight.get(uid)
+                if waiting is None:
+                    self.misses += 1
+                    waiting = self._inflight[uid] = threading.Event()
+                    break
+            waiting.wait()  # Another thread is fetching this key, use its result
+
+        try:
+            try:
+                key = self.loader(uid)
+            except Exception:
+                if entry is not None:
+                    return entry[0]  # expired but still the right key - better than failing during a network blip
+                raise
+            if key:
+                self.put(uid, key)
+            return key
+        finally:
+            with self._lock:
+                self._inflight.pop(uid, None)
+            waiting.set()
+
+    def put(self, uid, key):
+        with self._lock:
+            self._entries[uid] = (key, time.monotonic() + self.ttl)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, uid=None):
+        with self._lock:
+            if uid is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(uid, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def _load_from_database(uid):
+    import messaging.key_generator as key_generator
+
+    return key_generator.grab_symmetric_key(uid)
+
+
+key_cache = KeyCache()
+
+
+def get_symmetric_key(uid):
+    return key_cache.get(uid)
+
+
+def invalidate(uid=None):
+    key_cache.invalidate(uid)
@@ -0,0 +1,281 @@
+# Durable local outbox for outgoing messages.
+# Encrypted envelopes are written to SQLite before anything touches the network and are only deleted once the
+# database has confirmed them. A background flusher sends due envelopes in batches (one multi-path write per batch)
+# and backs off exponentially while the connection is down, so a burst of sends survives a network blip.
+
+import sqlite3
+import threading
+import time
+
+import messaging.fanout as fanout
+from user_auth.local_profile import profile_path
+
+BATCH_SIZE = 50
+BASE_DELAY = 1.0  # seconds before the first retry
+MAX_DELAY = 60.0  # retries never wait longer than this
+MAX_ATTEMPTS = 8  # for errors that aren't the connection being down - after that the envelope is given up on
+STALE_AFTER = 5.0  # seconds - older envelopes are checked against conversation_index before replacing its preview
+RETRY_NOW_INTERVAL = 10.0  # retry_now() resets the backoff at most this often
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS envelopes (
+    push_key TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    offline INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+# Envelopes the server rejected for good (rules denial, bad path) or that kept failing for another reason.
+# Kept rather than deleted so nothing the user typed silently disappears.
+_FAILED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS failed_envelopes (
+    push_key TEXT PRIMARY KEY,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+)
+"""
+
+
+def _status_code(exc):
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+def is_permanent_error(exc):
+    # A 4xx means the server understood the write and refused it, retrying won't change that (408 / 429 aside)
+    status = _status_code(exc)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def is_connection_error(exc):
+    # No HTTP response at all - DNS, refused connection, timeout (requests' errors are OSErrors too)
+    return isinstance(exc, OSError) and _status_code(exc) is None
+
+
+class Outbox:
+    def __init__(self, path=None, batch_size=BATCH_SIZE, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.path = str(path or profile_path("outbox.sqlite3"))
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.execute(_FAILED_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(envelopes)")}
+        if "offline" not in columns:  # outbox files from before the column existed
+            self._conn.execute("ALTER TABLE envelopes ADD COLUMN offline INTEGER NOT NULL DEFAULT 0")
+        self._conn.commit()
+
+        self._callbacks = {}  # push_key -> (on_delivered, on_retry, on_failed), only for envelopes queued by this process
+        self._wake = threading.Event()
+        self._thread = None
+        self.backing_off = False  # set while envelopes are waiting for the connection to come back
+        self._last_retry_now = 0.0
+
+    # --------- Queueing ---------
+    def enqueue(self, message_data, push_key=None, on_delivered=None, on_retry=None, on_failed=None):
+        push_key = push_key or fanout.new_push_key()
+        self.enqueue_many([(push_key, message_data)], on_delivered=on_delivered, on_retry=on_retry, on_failed=on_failed)
+        return push_key
+
+    def enqueue_many(self, items, on_delivered=None, on_retry=None, on_failed=None):
+        # items is a list of (push_key, message_data); the push key makes a resend after a lost reply harmless
+        rows = [
+            (push_key, data["sender"], data["receiver"], data["message"], data["timestamp"])
+            for push_key, data in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO envelopes (push_key, sender, receiver, message, timestamp) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            for push_key, _data in items:
+                if on_delivered or on_retry or on_failed:
+                    self._callbacks[push_key] = (on_delivered, on_retry, on_failed)
+        self.start()
+        self._wake.set()
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM envelopes").fetchone()[0]
+
+    # --------- Flushing ---------
+    def flush(self):
+        # Sends every envelope that is due, batch by batch. Returns how many were confirmed.
+        delivered = 0
+        while True:
+            batch = self._due_batch()
+            if not batch:
+                return delivered
+            try:
+                self._send(batch)
+            except Exception as exc:
+                if len(batch) == 1 or is_connection_error(exc):
+                    self._handle_failure(batch, exc)
+                    return delivered
+                # The server refused the batch - one bad envelope would otherwise hold back everything queued
+                # behind it, so send them one at a time to find it
+                for idx, row in enumerate(batch):
+                    try:
+                        self._send([row])
+                    except Exception as row_exc:
+                        if is_connection_error(row_exc):
+                            self._handle_failure(batch[idx:], row_exc)
+                            return delivered
+                        self._handle_failure([row], row_exc)
+                        continue
+                    self._mark_delivered([row])
+                    delivered += 1
+                continue
+            self._mark_delivered(batch)
+            delivered += len(batch)
+
+    def _send(self, rows):
+        writer = fanout.FanoutWriter()
+        now = time.time()
+        for push_key, sender, receiver, message, timestamp, attempts in rows:
+            data = fanout.build_message_data(sender, receiver, message, timestamp)
+            late = attempts > 0 or now - timestamp > STALE_AFTER
+            writer.add_message(data, push_key=push_key, check_index=late)
+        writer.commit()
+
+    def _due_batch(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT push_key, sender, receiver, message, timestamp, attempts FROM envelopes "
+                "WHERE next_attempt <= ? ORDER BY timestamp LIMIT ?",
+                (time.time(), self.batch_size),
+            ).fetchall()
+
+    def _mark_delivered(self, batch):
+        keys = [row[0] for row in batch]
+        with self._lock:
+            self._conn.executemany("DELETE FROM envelopes WHERE push_key = ?", [(k,) for k in keys])
+            self._conn.commit()
+            callbacks = [self._callbacks.pop(k, (None, None, None)) for k in keys]
+        for push_key, (on_delivered, _on_retry, _on_failed) in zip(keys, callbacks):
+            if on_delivered:
+                on_delivered(push_key)
+
+    def _handle_failure(self, rows, exc):
+        # Connection errors are retried for as long as it takes; anything else only MAX_ATTEMPTS times,
+        # and a permanent rejection not at all
+        offline = is_connection_error(exc)
+        give_up = [row for row in rows if is_permanent_error(exc) or (not offline and row[5] + 1 >= MAX_ATTEMPTS)]
+        if give_up:
+            self._give_up(give_up, exc)
+        retry = [row for row in rows if row not in give_up]
+        if retry:
+            self._schedule_retry(retry, exc, offline)
+
+    def _schedule_retry(self, batch, exc, offline=False):
+        now = time.time()
+        if offline:
+            self.backing_off = True
+        updates = []
+        for row in batch:
+            attempts = row[5] + 1
+            delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+            updates.append((attempts, now + delay, str(exc), int(offline), row[0]))
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE envelopes SET attempts = ?, next_attempt = ?, last_error = ?, offline = ? WHERE push_key = ?",
+                updates,
+            )
+            self._conn.commit()
+            callbacks = [(u[4], u[0], self._callbacks.get(u[4], (None, None, None))[1]) for u in updates]
+        for push_key, attempts, on_retry in callbacks:
+            if on_retry:
+                on_retry(push_key, attempts, exc)
+
+    def _give_up(self, rows, exc):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO failed_envelopes "
+                "(push_key, sender, receiver, message, timestamp, attempts, last_error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*row[:5], row[5] + 1, str(exc), now) for row in rows],
+            )
+            self._conn.executemany("DELETE FROM envelopes WHERE push_key = ?", [(row[0],) for row in rows])
+            self._conn.commit()
+            callbacks = [(row[0], self._callbacks.pop(row[0], (None, None, None))[2]) for row in rows]
+        for push_key, on_failed in callbacks:
+            print(f"Outbox gave up on {push_key}:", exc)
+            if on_failed:
+                on_failed(push_key, exc)
+
+    def failed_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM failed_envelopes").fetchone()[0]
+
+    def retry_now(self):
+        # Called right after a real round trip to the database succeeded. Only envelopes that failed because the
+        # connection was down are made due again - ones the server refused keep their backoff. Rate limited, so a
+        # listener polling every second can't keep hammering a write that still fails.
+        now = time.monotonic()
+        if not self.backing_off or now - self._last_retry_now < RETRY_NOW_INTERVAL:
+            return
+        self._last_retry_now = now
+        self.backing_off = False
+        with self._lock:
+            self._conn.execute("UPDATE envelopes SET next_attempt = 0 WHERE offline = 1")
+            self._conn.commit()
+        self._wake.set()
+
+    def _seconds_until_due(self):
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(next_attempt) FROM envelopes").fetchone()
+        if row[0] is None:
+            return None  # nothing queued, sleep until enqueue wakes us
+        return max(0.0, row[0] - time.time())
+
+    # --------- Background flusher ---------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="rucksapp-outbox", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._seconds_until_due())
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                print("Outbox flush error:", exc)
+                time.sleep(self.base_delay)
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+            _outbox.start()  # picks up anything left over from a previous run
+        return _outbox
+
+
+def notify_online():
+    # Hook for code that has just completed a request against the database (the message listener)
+    if _outbox is not None:
+        _outbox.retry_now()
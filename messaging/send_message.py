@@ -1,51 +1,87 @@
 # External imports
 import time
-from cryptography.fernet import Fernet
 
 # Internal imports
-from user_auth.firebase_config import db
-import messaging.key_generator as key_generator
+import messaging.key_cache as key_cache
+import messaging.ciphers as ciphers
+import messaging.fanout as fanout
+import messaging.outbox as outbox
+
+KEY_ATTEMPTS = 3  # the key has to be fetched before the envelope can reach the outbox, so ride out short blips
+KEY_RETRY_DELAY = 1.0
 
 UUID = "123456789"  # This accounts placeholder UUID - pretty much redundant for the current implementation.
 
 def grab_symmetric_key(UUID):
-    symmetric_key = key_generator.grab_symmetric_key(UUID)
+    symmetric_key = key_cache.get_symmetric_key(UUID)  # Only hits user_keys/<uid> on a cache miss
     print(symmetric_key)
     return symmetric_key
 
+def grab_symmetric_key_retrying(UUID, attempts=KEY_ATTEMPTS, delay=KEY_RETRY_DELAY):
+    for attempt in range(attempts):
+        try:
+            return grab_symmetric_key(UUID)
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * (2 ** attempt))
+
 def encrypt_message(plaintext, symmetric_key):
-    fernet = Fernet(symmetric_key)
-    encMessage = fernet.encrypt(plaintext.encode())
+    encMessage = ciphers.encrypt(plaintext, symmetric_key)  # cipher object is built once per key and reused
     print("original string: ", plaintext)
     print("encrypted string: ", encMessage)
     return encMessage
 
 def decrypt_message(encMessage, symmetric_key):
-    fernet = Fernet(symmetric_key)
-    decMessage = fernet.decrypt(encMessage).decode()
+    decMessage = ciphers.decrypt(encMessage, symmetric_key)
     return decMessage
 
-def upload_encrypted_message(sender_uuid, receiver_uuid, encrypted_bytes):
-    message_data = {
-        "sender": sender_uuid,
-        "receiver": receiver_uuid,
-        "timestamp": time.time(),
-        "message": encrypted_bytes.decode()
-    }
-    # 1. The global message log (not strictly necessary, but useful debugging)
-    db.child("messages").push(message_data)
-    # 2. The sender's conversation thread
-    db.child("user_messages").child(sender_uuid).child(receiver_uuid).push(message_data)
-    # 3. The receiver's conversation thread
-    db.child("user_messages").child(receiver_uuid).child(sender_uuid).push(message_data)
+def decrypt_envelopes(envelopes):
+    # Groups the envelopes by sender, so each sender's key and cipher are looked up once for the whole batch.
+    # Returns the plaintexts in the same order, with None where a message couldn't be decrypted.
+    texts = [None] * len(envelopes)
+    by_sender = {}
+    for idx, data in enumerate(envelopes):
+        by_sender.setdefault(data.get("sender"), []).append(idx)
+
+    for sender_uuid, indexes in by_sender.items():
+        if not sender_uuid:
+            continue
+        try:
+            symmetric_key = key_cache.get_symmetric_key(sender_uuid)
+        except Exception:
+            continue
+        if not symmetric_key:
+            continue
+        decrypted = ciphers.decrypt_many([envelopes[i].get("message", "") for i in indexes], symmetric_key)
+        for idx, text in zip(indexes, decrypted):
+            texts[idx] = text
+    return texts
 
+def upload_encrypted_message(sender_uuid, receiver_uuid, encrypted_bytes, keep_global_log=None, push_key=None):
+    message_data = fanout.build_message_data(sender_uuid, receiver_uuid, encrypted_bytes)
+    # The global log, sender's thread and receiver's thread all go out in one multi-path write
+    writer = fanout.FanoutWriter(keep_global_log=keep_global_log)
+    push_key = writer.add_message(message_data, push_key=push_key)
+    writer.commit()
+    return push_key
 
 
-def send_message(sender_uuid,  receiver_uuid, message): # Remeber new parameter receiver_uuid
+
+def queue_encrypted_message(sender_uuid, receiver_uuid, encrypted_bytes, push_key=None, on_delivered=None, on_retry=None, on_failed=None):
+    # Durable version of upload_encrypted_message - the envelope sits in the local outbox until the database confirms it
+    # (or rejects it for good, which is what on_failed reports)
+    message_data = fanout.build_message_data(sender_uuid, receiver_uuid, encrypted_bytes)
+    return outbox.get_outbox().enqueue(
+        message_data, push_key=push_key, on_delivered=on_delivered, on_retry=on_retry, on_failed=on_failed
+    )
+
+def send_message(sender_uuid,  receiver_uuid, message, push_key=None, on_delivered=None, on_retry=None, on_failed=None): # Remeber new parameter receiver_uuid
     ut = time.time()
-    symmetric_key = grab_symmetric_key(sender_uuid) # Migrating the code from UUID to the new sender_uuid
+    symmetric_key = grab_symmetric_key_retrying(sender_uuid) # Migrating the code from UUID to the new sender_uuid
     encrypted_message = encrypt_message(message, symmetric_key)
-    upload_encrypted_message(sender_uuid, receiver_uuid, encrypted_message)
+    # Goes through the outbox so a failed write is retried instead of lost, push_key lets the GUI match its pending bubble
+    queue_encrypted_message(sender_uuid, receiver_uuid, encrypted_message, push_key, on_delivered, on_retry, on_failed)
 
      #Testing decryption time (here for demonstration purposes)
     decrypted_message = decrypt_message(encrypted_message, symmetric_key)
@@ -54,4 +90,48 @@ def send_message(sender_uuid,  receiver_uuid, message): # Remeber new parameter
     print("Time taken to encrypt and decrypt the message: ", ft - ut)
     print("\n")
     
-    return encrypted_message
\ No newline at end of file
+    return encrypted_message
+
+
+def send_messages(sender_uuid, outgoing, keep_global_log=None):
+    # Bulk version of send_message for scripted / broadcast traffic: outgoing is a list of (receiver_uuid, message).
+    # The sender's key is resolved once, everything is encrypted in one batch and committed in one multi-path write.
+    # Returns one result dict per message, in the same order as outgoing.
+    results = [{"receiver": receiver_uuid, "push_key": None, "ok": False, "error": None} for receiver_uuid, _m in outgoing]
+    if not outgoing:
+        return results
+
+    symmetric_key = key_cache.get_symmetric_key(sender_uuid)
+    try:
+        encrypted = ciphers.encrypt_many([message for _r, message in outgoing], symmetric_key)
+    except Exception:
+        # Something in the batch can't be encrypted (e.g. not a str), redo it one by one to find out which
+        fernet = ciphers.get_cipher(symmetric_key)
+        encrypted = []
+        for result, (_receiver_uuid, message) in zip(results, outgoing):
+            try:
+                encrypted.append(fernet.encrypt(message.encode()))
+            except Exception as exc:
+                encrypted.append(None)
+                result["error"] = str(exc)
+
+    writer = fanout.FanoutWriter(keep_global_log=keep_global_log)
+    timestamp = time.time()
+    for idx, (result, encrypted_message) in enumerate(zip(results, encrypted)):
+        if encrypted_message is None:
+            continue
+        # Nudge each timestamp so messages to the same receiver keep their order when sorted
+        message_data = fanout.build_message_data(sender_uuid, result["receiver"], encrypted_message, timestamp + idx * 1e-6)
+        result["push_key"] = writer.add_message(message_data)
+
+    try:
+        writer.commit()
+    except Exception as exc:
+        for result in results:
+            if result["push_key"] is not None:
+                result["error"] = str(exc)
+        return results
+
+    for result in results:
+        result["ok"] = result["push_key"] is not None
+    return results
@@ -0,0 +1,34 @@
+# Background send queue.
+# Jobs run one at a time on a single worker thread, so messages still go out in the order they were typed,
+# but the caller (the Tk main loop) never waits on spam scoring, key fetches, encryption or network writes.
+
+import queue
+import threading
+
+
+class SendQueue:
+    def __init__(self, name="rucksapp-send-queue"):
+        self._jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, job, on_success=None, on_failure=None):
+        # on_success / on_failure are called from the worker thread - GUI callers must marshal them back themselves
+        self._jobs.put((job, on_success, on_failure))
+
+    def pending(self):
+        return self._jobs.qsize()
+
+    def _run(self):
+        while True:
+            job, on_success, on_failure = self._jobs.get()
+            try:
+                result = job()
+            except Exception as exc:
+                if on_failure:
+                    on_failure(exc)
+            else:
+                if on_success:
+                    on_success(result)
+            finally:
+                self._jobs.task_done()
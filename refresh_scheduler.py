@@ -0,0 +1,60 @@
+# Coalescing refresh scheduler for the GUI.
+# Instead of reloading every view on a timer, anything that changes data (an incoming batch, a delivered send,
+# a profile save) marks the affected views dirty. Dirty views are refreshed together once the current burst of
+# events has settled (the frame budget), and each view runs at most once per its own min_interval - a view that
+# isn't dirty costs nothing at all.
+
+import time
+
+FRAME_BUDGET_MS = 50  # how long triggers are collected before anything runs
+
+
+class RefreshScheduler:
+    def __init__(self, root, frame_budget_ms=FRAME_BUDGET_MS):
+        self.root = root
+        self.frame_budget_ms = frame_budget_ms
+        self._views = {}  # name -> {"refresh", "min_interval", "last_run", "dirty", "runs"}
+        self._after = None
+        self._due = None  # monotonic time the pending flush is set for
+
+    def register(self, name, refresh, min_interval=1.0):
+        self._views[name] = {"refresh": refresh, "min_interval": min_interval, "last_run": 0.0, "dirty": False, "runs": 0}
+
+    def mark_dirty(self, *names):
+        for name in names:
+            self._views[name]["dirty"] = True
+        self._schedule(self.frame_budget_ms / 1000)
+
+    def _schedule(self, delay):
+        due = time.monotonic() + delay
+        if self._after is not None:
+            if self._due <= due:
+                return  # a flush is already coming soon enough, this trigger rides along with it
+            self.root.after_cancel(self._after)
+        self._due = due
+        self._after = self.root.after(max(0, int(delay * 1000)), self._flush)
+
+    def _flush(self):
+        self._after = None
+        self._due = None
+        now = time.monotonic()
+        next_due = None
+        for name, view in self._views.items():
+            if not view["dirty"]:
+                continue
+            wait = view["last_run"] + view["min_interval"] - now
+            if wait > 0:
+                next_due = wait if next_due is None else min(next_due, wait)  # ran too recently, stays dirty
+                continue
+            view["dirty"] = False
+            view["last_run"] = now
+            view["runs"] += 1
+            try:
+                view["refresh"]()
+            except Exception as exc:
+                print(f"Refresh of {name} failed:", exc)
+        if next_due is not None:
+            self._schedule(next_due)
+
+    def metrics(self):
+        return {name: view["runs"] for name, view in self._views.items()}
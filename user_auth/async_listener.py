@@ -0,0 +1,121 @@
+# asyncio listener service for processes that watch many inboxes at once (bots, test harnesses).
+# Instead of one listen_for_messages thread per uid, a single event loop schedules every subscribed inbox and runs
+# the incremental polls on a small shared worker pool. All workers go through the same pyrebase requests session,
+# so the HTTP connections are pooled and reused across users.
+#
+#     service = AsyncInboxService()
+#     service.subscribe(uid, handler)   # handler(batch), plain function or coroutine
+#     await service.run()
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from user_auth.message_listener import ListenerState, poll_once
+from user_auth.poll_scheduler import AdaptivePollScheduler
+
+MAX_WORKERS = 16  # concurrent database requests, however many inboxes are subscribed
+IDLE_TICK = 1.0  # longest the loop sleeps when nothing is due
+
+
+class _Subscription:
+    def __init__(self, uid, handler):
+        self.uid = uid
+        self.handler = handler
+        self.state = None  # loaded from the cursor file on the first poll
+        self.scheduler = AdaptivePollScheduler()
+        self.next_poll = 0.0
+        self.polling = False
+
+
+class AsyncInboxService:
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rucksapp-inbox")
+        self._subscriptions = {}
+        self._wake = None
+        self._running = False
+
+    def subscribe(self, uid, handler):
+        self._subscriptions[uid] = _Subscription(uid, handler)
+        self._poke()
+
+    def unsubscribe(self, uid):
+        self._subscriptions.pop(uid, None)
+
+    def record_activity(self, uid):
+        # Same as the GUI's scheduler hook - poll this inbox fast again, starting now
+        sub = self._subscriptions.get(uid)
+        if sub is not None:
+            sub.scheduler.record_activity()
+            sub.next_poll = 0.0
+            self._poke()
+
+    def _poke(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        self._running = True
+        tasks = set()
+        try:
+            while self._running:
+                now = time.monotonic()
+                for sub in list(self._subscriptions.values()):
+                    if not sub.polling and sub.next_poll <= now:
+                        sub.polling = True
+                        task = asyncio.ensure_future(self._poll(sub))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+
+                waiting = [s.next_poll for s in self._subscriptions.values() if not s.polling]
+                timeout = min([IDLE_TICK] + [max(0.0, t - time.monotonic()) for t in waiting])
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stop(self):
+        self._running = False
+        self._poke()
+
+    def close(self):
+        self.stop()
+        self._executor.shutdown(wait=False)
+
+    async def _poll(self, sub):
+        loop = asyncio.get_running_loop()
+        batches = []
+        new_messages = 0
+        try:
+            new_messages = await loop.run_in_executor(self._executor, self._poll_blocking, sub, batches.append)
+        except Exception as exc:
+            print(f"Inbox poll error for {sub.uid}:", exc)
+
+        for batch in batches:
+            await self._dispatch(sub, batch)
+
+        sub.scheduler.record_poll(new_messages)
+        sub.next_poll = time.monotonic() + sub.scheduler.current_interval
+        sub.polling = False
+        self._poke()
+
+    @staticmethod
+    def _poll_blocking(sub, on_batch):
+        if sub.state is None:
+            sub.state = ListenerState.load(sub.uid)
+        return poll_once(sub.uid, on_batch, sub.state)
+
+    async def _dispatch(self, sub, batch):
+        if self._subscriptions.get(sub.uid) is not sub:
+            return  # unsubscribed while the poll was in flight
+        try:
+            result = sub.handler(batch)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as exc:
+            print(f"Inbox handler error for {sub.uid}:", exc)
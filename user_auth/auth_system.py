@@ -1,4 +1,5 @@
 from user_auth.firebase_config import db, auth
+from user_auth.user_directory import SERVER_TIMESTAMP
 
 
 def register(email, password, first_name="", surname=""):
@@ -19,7 +20,8 @@ def register(email, password, first_name="", surname=""):
             "display_name": display_name,
             "profile_initial": profile_initial,
             "profile_picture": "",
-            "status": ""
+            "status": "",
+            "updated_at": SERVER_TIMESTAMP
         })
 
         return uid
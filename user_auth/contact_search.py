@@ -0,0 +1,99 @@
+# Contact search by email prefix.
+# Runs an indexed range query on users/email_lower (needs ".indexOn": ["email_lower"], see database.rules.json),
+# so a search only returns the first few matches instead of the whole users tree. Every match is also remembered
+# in a small prefix trie, which answers type-ahead instantly from what we've already seen.
+
+import threading
+
+from user_auth.firebase_config import db
+from user_auth.user_directory import compact_record, directory
+
+SEARCH_LIMIT = 20
+
+
+class PrefixTrie:
+    def __init__(self):
+        self._root = {}
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def add(self, key, uid):
+        with self._lock:
+            node = self._root
+            for ch in key:
+                node = node.setdefault(ch, {})
+            uids = node.setdefault(None, set())  # None marks the end of a key
+            if uid not in uids:
+                uids.add(uid)
+                self.size += 1
+
+    def find(self, prefix, limit=SEARCH_LIMIT):
+        # Returns up to `limit` (key, uid) pairs starting with prefix, in key order - same as the server query
+        with self._lock:
+            node = self._root
+            for ch in prefix:
+                node = node.get(ch)
+                if node is None:
+                    return []
+            found = []
+            stack = [(prefix, node)]
+            while stack and len(found) < limit:
+                key, node = stack.pop()
+                for uid in sorted(node.get(None, ())):
+                    found.append((key, uid))
+                children = sorted(ch for ch in node if ch is not None)
+                stack.extend((key + ch, node[ch]) for ch in reversed(children))  # smallest popped first
+            return found[:limit]
+
+
+class ContactSearch:
+    def __init__(self, limit=SEARCH_LIMIT):
+        self.limit = limit
+        self.trie = PrefixTrie()
+        self.remote_queries = 0
+
+    def remember(self, uid, data):
+        email_lower = (data.get("email_lower") or data.get("email") or "").strip().lower()
+        if email_lower:
+            self.trie.add(email_lower, uid)
+
+    def local(self, prefix, limit=None):
+        # Instant, but only knows users that some earlier search (or the directory) has already returned
+        prefix = prefix.strip().lower()
+        results = []
+        for _key, uid in self.trie.find(prefix, limit or self.limit):
+            record = directory.get(uid, fetch=False)
+            if record is not None:
+                results.append((uid, record))
+        return results
+
+    def remote(self, prefix, limit=None):
+        prefix = prefix.strip().lower()
+        limit = limit or self.limit
+        self.remote_queries += 1
+        # "\uf8ff" sorts after any character we'd see in an email, so [prefix, prefix + "\uf8ff"] is "starts with prefix"
+        users = (
+            db.child("users").order_by_child("email_lower")
+            .start_at(prefix).end_at(prefix + "\uf8ff").limit_to_first(limit).get()
+        )
+        results = []
+        for user in ((users.each() or []) if users else []):
+            record = directory.put(user.key(), compact_record(user.val()))
+            self.remember(user.key(), record)
+            results.append((user.key(), record))
+        return results
+
+    def search(self, prefix, limit=None):
+        try:
+            return self.remote(prefix, limit)
+        except Exception as exc:
+            print("Contact search error:", exc)
+            return self.local(prefix, limit)
+
+    def seed(self, records):
+        # Feed the trie from records we already hold (e.g. the user directory) so type-ahead starts warm
+        for uid, data in records.items():
+            self.remember(uid, data)
+
+
+contact_search = ContactSearch()
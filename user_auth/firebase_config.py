@@ -1,3 +1,5 @@
+import threading
+
 import pyrebase
 
 firebase_config = {
@@ -12,5 +14,20 @@ firebase_config = {
 
 firebase = pyrebase.initialize_app(firebase_config)
 
+
+class _ThreadLocalDatabase:
+    # pyrebase builds each request's path and query on the Database object itself (db.child(...).get()),
+    # so two threads sharing one object can mix their paths together. Every thread gets its own instance instead.
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        database = getattr(self._local, "database", None)
+        if database is None:
+            database = self._local.database = self._app.database()
+        return getattr(database, name)
+
+
 auth = firebase.auth()
-db = firebase.database() # for the realtime database
+db = _ThreadLocalDatabase(firebase) # for the realtime database
@@ -0,0 +1,17 @@
+# Where RucksApp keeps its local state (outbox, listener cursors, caches) for the current OS user.
+# Defaults to ~/.rucksapp, RUCKSAPP_HOME can point it somewhere else (handy for running two accounts side by side).
+
+import os
+from pathlib import Path
+
+
+def profile_dir():
+    path = Path(os.environ.get("RUCKSAPP_HOME") or Path.home() / ".rucksapp")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def profile_path(*parts):
+    path = profile_dir().joinpath(*parts)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
@@ -1,51 +1,286 @@
-from user_auth.firebase_config import db 
+import json
+import os
+import queue
 import time
-import messaging.key_generator as key_generator
-from cryptography.fernet import Fernet
 
-def listen_for_messages(user_uuid, callback):
-    from user_auth.firebase_config import db
-    import time
-    import messaging.key_generator as key_generator
-    from cryptography.fernet import Fernet
+from user_auth.firebase_config import db
+from user_auth.local_profile import profile_path
+from user_auth.poll_scheduler import AdaptivePollScheduler
+import messaging.outbox as outbox
+import messaging.send_message as send_message
 
-    # load this user’s symmetric key
-    symmetric_key = key_generator.grab_symmetric_key(user_uuid)
-    f = Fernet(symmetric_key)
+STREAM_IDLE_CHECK = 5  # how often (seconds) we check the stream thread is still alive while no events arrive
+STREAM_MAX_FAILURES = 3  # consecutive stream failures before falling back to polling
+STREAM_RETRY_DELAY = 2  # seconds, doubled after each failed reconnect
+STREAM_RETRY_AFTER = 30  # seconds of polling before streaming is tried again, doubled after each failed try
+STREAM_RETRY_MAX = 600
 
-    last_seen = 0
 
-    while True:
-        chats = db.child("user_messages").child(user_uuid).get()
+class ListenerState:
+    # Tracks what the callback has already been given, shared by the streaming and polling paths
+    # so a reconnect (which resends the whole snapshot) or a fallback doesn't fire anything twice.
+    # There's one cursor per partner thread - a single global timestamp would drop a message that lands
+    # in one thread with an older timestamp than something we've already seen in another.
+    def __init__(self, since=0):
+        self.since = since  # cursor used for threads we haven't seen anything in yet
+        self.threads = {}  # partner uid -> {"ts": newest timestamp seen, "ids": message ids seen at exactly that timestamp}
+        self.path = None  # where save() writes to, set by load()
+        self.dirty = False
+
+    def cursor(self, partner_uid):
+        entry = self.threads.get(partner_uid)
+        return entry["ts"] if entry else self.since
+
+    def is_new(self, partner_uid, msg_id, ts):
+        entry = self.threads.get(partner_uid)
+        if entry is None:
+            return ts > self.since
+        return ts > entry["ts"] or (ts == entry["ts"] and msg_id not in entry["ids"])
+
+    def mark_seen(self, partner_uid, msg_id, ts):
+        entry = self.threads.get(partner_uid)
+        if entry is None or ts > entry["ts"]:
+            self.threads[partner_uid] = {"ts": ts, "ids": {msg_id}}
+            self.dirty = True
+        elif ts == entry["ts"] and msg_id not in entry["ids"]:
+            entry["ids"].add(msg_id)
+            self.dirty = True
+
+    # --------- Persistence ---------
+    # Cursors are saved under the local profile so a restart only processes messages we haven't seen yet
+    @classmethod
+    def load(cls, user_uuid):
+        path = profile_path("cursors", f"{user_uuid}.json")
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            state = cls(since=saved.get("since", 0))
+            for partner_uid, entry in saved.get("threads", {}).items():
+                state.threads[partner_uid] = {"ts": entry["ts"], "ids": set(entry["ids"])}
+        except (OSError, ValueError, KeyError, TypeError):
+            # First launch (or an unreadable file) - the GUI loads history itself, so only deliver from now on
+            state = cls(since=time.time())
+            state.dirty = True
+        state.path = path
+        return state
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        saved = {
+            "since": self.since,
+            "threads": {p: {"ts": e["ts"], "ids": sorted(e["ids"])} for p, e in self.threads.items()},
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(saved, f)
+            os.replace(tmp_path, self.path)  # atomic, a crash mid-write can't leave a half-written cursor file
+            self.dirty = False
+        except OSError as exc:
+            print("Could not save listener cursors:", exc)
+
+
+def _deliver(envelopes, state, on_batch):
+    # envelopes is a list of (partner_uid, msg_id, data); only the unseen ones are decrypted, and everything
+    # new from one poll or stream event goes to on_batch as a single list rather than one call per message
+    fresh = []
+    for partner_uid, msg_id, data in envelopes:
+        if not isinstance(data, dict) or data.get("message") is None:
+            continue # skip malformed
+        if state.is_new(partner_uid, msg_id, data.get("timestamp", 0)):
+            fresh.append((partner_uid, msg_id, data))
+
+    fresh.sort(key=lambda item: item[2].get("timestamp", 0))
+    # Each message is decrypted with its sender's key (cached), not just ours
+    texts = send_message.decrypt_envelopes([data for _p, _m, data in fresh])
+
+    batch = []
+    for (partner_uid, msg_id, data), decrypted in zip(fresh, texts):
+        state.mark_seen(partner_uid, msg_id, data.get("timestamp", 0))
+        if decrypted is None:
+            continue # encrypted with another key or corrupted
+        batch.append({
+            "sender": partner_uid,
+            "message": decrypted,
+            "id": msg_id,
+            "from": data.get("sender"),
+            "timestamp": data.get("timestamp", 0),
+        })
+
+    if batch:
+        on_batch(batch)
+    state.save()
+    return len(fresh)
+
+
+def _changed_in(path, data, changed):
+    # `path` is relative to conversation_index/<uid>; its first segment is the partner whose thread changed.
+    # Records partner -> (push_key, timestamp) of the indexed latest envelope when the event carries it, else None.
+    parts = [p for p in path.split("/") if p]
+    if not parts:
+        for partner_uid, node in (data.items() if isinstance(data, dict) else ()):
+            _changed_in(partner_uid, node, changed)
+        return
+    partner_uid = parts[0]
+    latest = None
+    if len(parts) == 1 and isinstance(data, dict) and "push_key" in data:
+        latest = (data["push_key"], data.get("timestamp", 0))
+    if partner_uid not in changed or latest is None:
+        changed[partner_uid] = latest
+
+
+def _changed_threads(event):
+    path = event.get("path") or "/"
+    data = event.get("data")
+    changed = {}
+    if event.get("event") == "patch" and isinstance(data, dict):
+        # A patch carries several child paths relative to the event path, e.g. {"<partner>/timestamp": ...}
+        for child_path, value in data.items():
+            _changed_in(path.rstrip("/") + "/" + child_path, value, changed)
+    else:
+        _changed_in(path, data, changed)
+    return changed
+
+
+def _fetch_changed(user_uuid, changed, state):
+    # Only the threads the index says changed are queried, each from its own cursor
+    envelopes = []
+    for partner_uid, latest in changed.items():
+        if latest is not None and not state.is_new(partner_uid, *latest):
+            continue  # the index's latest envelope was already delivered, e.g. the snapshot after a reconnect
+        envelopes.extend(_fetch_thread_since(user_uuid, partner_uid, state.cursor(partner_uid)))
+    return envelopes
 
-        if chats and chats.val():
-            for partner_uid, thread in chats.val().items():
 
-                # skip invalid threads
-                if not isinstance(thread, dict):
+def _close_stream(stream):
+    if stream is None or stream.sse is None:
+        return # never connected, the stream thread has already died on its own
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+
+def stream_messages(user_uuid, on_batch, state=None, max_failures=STREAM_MAX_FAILURES):
+    # Subscribes to the realtime database's streaming (SSE) endpoint on conversation_index/<uid> - one small node per
+    # conversation - rather than on the messages themselves, so a (re)connect never downloads the whole history.
+    # Each change to a conversation's node fetches just that thread from its cursor.
+    # Reconnects with backoff, resuming from `state`. Returns once streaming has failed max_failures times in a row,
+    # True if it got any data before that.
+    state = state or ListenerState()
+    failures = 0
+    delay = STREAM_RETRY_DELAY
+    connected = False
+
+    while True:
+        events = queue.Queue()
+        stream = None
+        got_data = False
+        try:
+            stream = db.child("conversation_index").child(user_uuid).stream(events.put)
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_IDLE_CHECK)
+                except queue.Empty:
+                    if stream.thread is None or not stream.thread.is_alive():
+                        break # connection dropped and the SSE client couldn't reconnect
                     continue
 
-                for msg_id, data in thread.items():
+                kind = event.get("event")
+                if kind in ("cancel", "auth_revoked"):
+                    break
+                if kind not in ("put", "patch"):
+                    continue
+
+                if not got_data:
+                    outbox.notify_online()  # (re)connected - queued sends don't have to wait out their backoff
+                got_data = connected = True
+                failures = 0
+                delay = STREAM_RETRY_DELAY
+                _deliver(_fetch_changed(user_uuid, _changed_threads(event), state), state, on_batch)
+        except Exception as exc:
+            print("Message stream error:", exc)
+        finally:
+            _close_stream(stream)
+
+        if not got_data:
+            failures += 1
+            if failures >= max_failures:
+                return connected
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
+
 
-                    ts = data.get("timestamp", 0)
-                    encrypted = data.get("message")
+def _list_threads(user_uuid):
+    # shallow=true only returns the partner uids, not the messages under them
+    threads = db.child("user_messages").child(user_uuid).shallow().get()
+    return list(threads.val() or []) if threads else []
 
-                    # skip malformed
-                    if encrypted is None:
-                        continue
 
-                    if ts > last_seen:
-                        try:
-                            decrypted = f.decrypt(encrypted.encode()).decode()
-                        except Exception:
-                            continue # encrypted with another key or corrupted
+def _fetch_thread_since(user_uuid, partner_uid, since):
+    # Server-side range query on the thread, needs ".indexOn": ["timestamp"] (see database.rules.json).
+    # startAt is inclusive, so messages at exactly `since` come back again and are filtered by ListenerState.
+    result = (
+        db.child("user_messages").child(user_uuid).child(partner_uid)
+        .order_by_child("timestamp").start_at(since).get()
+    )
+    return [(partner_uid, item.key(), item.val()) for item in (result.each() or [])] if result else []
 
-                        callback({
-                            "sender": partner_uid,
-                            "message": decrypted
-                        })
 
-                        last_seen = ts
+def poll_once(user_uuid, on_batch, state):
+    envelopes = []
+    for partner_uid in _list_threads(user_uuid):
+        envelopes.extend(_fetch_thread_since(user_uuid, partner_uid, state.cursor(partner_uid)))
+    return _deliver(envelopes, state, on_batch)
 
-        time.sleep(1)
- # Works here for some reason?
+
+def poll_messages(user_uuid, on_batch, state=None, scheduler=None, until=None):
+    # Each poll costs one shallow listing plus one query per thread, and only new messages come back.
+    # The scheduler decides how long to wait in between (fast while chatting, backing off while idle).
+    # With `until` (a time.monotonic() deadline) it returns after that, so the caller can try streaming again.
+    state = state or ListenerState()
+    scheduler = scheduler or AdaptivePollScheduler()
+
+    while until is None or time.monotonic() < until:
+        new_messages = 0
+        try:
+            new_messages = poll_once(user_uuid, on_batch, state)
+            outbox.notify_online()
+        except Exception as exc:
+            print("Message poll error:", exc)
+
+        scheduler.record_poll(new_messages)
+        scheduler.wait()
+
+
+def listen_for_messages(user_uuid, callback, use_stream=True, scheduler=None, batched=False):
+    # With batched=True the callback gets a list of messages per poll / stream event,
+    # otherwise it's called once per message like the older GUIs expect
+    if batched:
+        on_batch = callback
+    else:
+        def on_batch(batch):
+            for msg in batch:
+                callback(msg)
+
+    state = ListenerState.load(user_uuid)
+    if not use_stream:
+        poll_messages(user_uuid, on_batch, state, scheduler)
+        return
+
+    # Polls while streaming is down, and tries the stream again on a backoff timer - one failed attempt per try,
+    # so a retry doesn't hold up polling - going back to streaming as soon as it connects
+    scheduler = scheduler or AdaptivePollScheduler()
+    max_failures = STREAM_MAX_FAILURES
+    retry_after = STREAM_RETRY_AFTER
+    while True:
+        scheduler.mode = "streaming"
+        if stream_messages(user_uuid, on_batch, state, max_failures):
+            retry_after = STREAM_RETRY_AFTER  # it was working, so this is a fresh outage
+        elif max_failures == 1:
+            retry_after = min(retry_after * 2, STREAM_RETRY_MAX)
+        print(f"Streaming unavailable, polling for {retry_after:.0f}s before trying again.")
+        scheduler.mode = "polling"
+        poll_messages(user_uuid, on_batch, state, scheduler, until=time.monotonic() + retry_after)
+        max_failures = 1
@@ -0,0 +1,59 @@
+# Adaptive interval for the polling listener.
+# Polls fast while a conversation is active, then backs off exponentially once the inbox has been quiet for a while.
+# Anything that suggests the user is back (sending, opening or focusing a chat) jumps straight back to fast polling.
+
+import threading
+import time
+
+FAST_INTERVAL = 1.0  # seconds
+SLOW_INTERVAL = 30.0  # the longest we'll ever go between polls
+BACKOFF_FACTOR = 2.0
+ACTIVE_WINDOW = 20.0  # seconds of quiet at the fast rate before backing off
+
+
+class AdaptivePollScheduler:
+    def __init__(self, fast=FAST_INTERVAL, slow=SLOW_INTERVAL, factor=BACKOFF_FACTOR, active_window=ACTIVE_WINDOW):
+        self.fast = fast
+        self.slow = slow
+        self.factor = factor
+        self.active_window = active_window
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._interval = fast
+        self._last_activity = time.monotonic()
+        self.polls = 0
+        self.mode = "polling"  # the listener sets "streaming" while its stream is up, when the interval doesn't apply
+
+    @property
+    def current_interval(self):
+        return self._interval
+
+    def record_activity(self):
+        # Called from the GUI (send / open chat / window focus) - resets to fast polling and cuts the current sleep short
+        with self._lock:
+            self._last_activity = time.monotonic()
+            self._interval = self.fast
+        self._wake.set()
+
+    def record_poll(self, new_messages):
+        with self._lock:
+            self.polls += 1
+            if new_messages:
+                self._last_activity = time.monotonic()
+                self._interval = self.fast
+            elif time.monotonic() - self._last_activity > self.active_window:
+                self._interval = min(self.slow, self._interval * self.factor)
+
+    def wait(self):
+        self._wake.wait(self._interval)
+        self._wake.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "interval": self._interval,
+                "idle_for": time.monotonic() - self._last_activity,
+                "polls": self.polls,
+                "mode": self.mode,
+            }
@@ -0,0 +1,111 @@
+# Shared cache of the "users" table.
+# Holds a compact record per user and, after the first full load, only asks the database for users whose
+# updated_at is at or after the newest one we've seen - so the chat list, contacts and profile pages can all
+# read names and pictures without pulling the whole users tree every refresh.
+
+import threading
+import time
+
+from user_auth.firebase_config import db
+
+MIN_REFRESH_INTERVAL = 10  # seconds between incremental refreshes, unless forced
+FULL_RESYNC_INTERVAL = 600  # full reload now and then, for records written by clients that don't set updated_at
+
+RECORD_FIELDS = (
+    "email",
+    "email_lower",
+    "first_name",
+    "surname",
+    "display_name",
+    "profile_initial",
+    "profile_picture",
+    "status",
+    "updated_at",
+)
+
+
+SERVER_TIMESTAMP = {".sv": "timestamp"}  # write this as updated_at - server time in ms, so client clocks don't matter
+
+
+def compact_record(data):
+    record = {field: data[field] for field in RECORD_FIELDS if field in (data or {})}
+    if not isinstance(record.get("updated_at", 0), (int, float)):
+        del record["updated_at"]  # an unresolved SERVER_TIMESTAMP from a local write, the next refresh brings the real one
+    return record
+
+
+class UserDirectory:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = {}
+        self.watermark = 0  # newest updated_at seen so far, server time in ms
+        self.version = 0  # bumped whenever a record changes, so views can tell if they need redrawing
+        self._last_refresh = 0
+        self._last_full = 0
+
+    def refresh(self, force=False):
+        # Returns True if any record changed
+        now = time.time()
+        if not force and now - self._last_refresh < MIN_REFRESH_INTERVAL:
+            return False
+        self._last_refresh = now
+
+        if not self.records or now - self._last_full > FULL_RESYNC_INTERVAL:
+            users = db.child("users").get()
+            self._last_full = now
+            return self._merge(users, full=True)
+
+        # startAt is inclusive, so the users at exactly the watermark come back again - they compare equal and are ignored
+        users = db.child("users").order_by_child("updated_at").start_at(self.watermark).get()
+        return self._merge(users)
+
+    def _merge(self, users, full=False):
+        fetched = {}
+        for user in ((users.each() or []) if users else []):
+            fetched[user.key()] = compact_record(user.val())
+
+        changed = False
+        with self._lock:
+            if full:
+                for uid in [uid for uid in self.records if uid not in fetched]:
+                    del self.records[uid]
+                    changed = True
+            for uid, record in fetched.items():
+                if self.records.get(uid) != record:
+                    self.records[uid] = record
+                    changed = True
+                self.watermark = max(self.watermark, record.get("updated_at", 0) or 0)
+            if changed:
+                self.version += 1
+        return changed
+
+    def get(self, uid, fetch=True):
+        with self._lock:
+            record = self.records.get(uid)
+        if record is not None or not fetch:
+            return record
+        # Not seen yet (e.g. a brand new account) - fetch just that one user
+        data = db.child("users").child(uid).get()
+        if not data or not data.val():
+            return None
+        return self.put(uid, data.val())
+
+    def put(self, uid, data):
+        # Local update after we've written a profile ourselves, so the next refresh has nothing to redraw
+        with self._lock:
+            record = dict(self.records.get(uid, {}), **compact_record(data))
+            if self.records.get(uid) != record:
+                self.records[uid] = record
+                self.version += 1
+            return record
+
+    def display_name(self, uid, default="Unknown User"):
+        record = self.get(uid, fetch=False) or {}
+        return record.get("display_name") or record.get("email") or default
+
+    def all(self):
+        with self._lock:
+            return dict(self.records)
+
+
+directory = UserDirectory()
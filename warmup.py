@@ -0,0 +1,88 @@
+# Startup warm-up.
+# The slow subsystems (training the spam model, loading Q# for the key generator, opening the local outbox) used to be
+# imported before the window existed. Now the window comes up first and each of them warms up on its own thread while
+# the splash screen is showing. Timings for every phase are kept so startup regressions are easy to spot.
+
+import threading
+import time
+
+WARMUP_TIMEOUT = 15.0  # seconds - the splash gives up waiting after this, slow phases carry on in the background
+
+
+def _load_spam_model():
+    import spam_detection.main  # reads the CSV and trains the model on import
+
+
+def _load_key_generator():
+    import messaging.key_generator  # imports qsharp and prints the banner
+
+
+def _open_outbox():
+    import messaging.outbox as outbox
+
+    outbox.get_outbox()  # also starts delivering anything left over from the last run
+
+
+PHASES = (
+    ("spam model", _load_spam_model),
+    ("key generator", _load_key_generator),
+    ("outbox", _open_outbox),
+)
+
+
+class WarmUp:
+    def __init__(self, phases=PHASES, dispatch=None, started_at=None):
+        self.phases = phases
+        self.dispatch = dispatch or (lambda fn: fn())  # the GUI passes root.after so on_done runs on the Tk thread
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.timings = {}  # phase -> seconds
+        self.errors = {}  # phase -> exception
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._on_done = None
+        self._began = None
+        self.done = False
+
+    def mark(self, phase):
+        # Records a phase that happens outside the warm-up threads, e.g. the window appearing
+        with self._lock:
+            self.timings[phase] = time.perf_counter() - self.started_at
+
+    def start(self, on_done=None):
+        self._on_done = on_done
+        self._began = time.perf_counter()
+        self._remaining = len(self.phases)
+        if not self.phases:
+            self._finish()
+            return
+        for name, fn in self.phases:
+            threading.Thread(target=self._run, args=(name, fn), name=f"rucksapp-warmup-{name}", daemon=True).start()
+
+    def _run(self, name, fn):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as exc:
+            self.errors[name] = exc  # the feature fails later with a proper error, startup shouldn't
+        with self._lock:
+            self.timings[name] = time.perf_counter() - start
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            self.dispatch(self._finish)
+
+    def _finish(self):
+        if self.done:
+            return
+        self.done = True
+        with self._lock:
+            self.timings["warm-up"] = time.perf_counter() - self._began
+            self.timings["total"] = time.perf_counter() - self.started_at
+        if self._on_done is not None:
+            self._on_done()
+
+    def report(self):
+        with self._lock:
+            parts = [f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()]
+            parts.extend(f"{name} failed: {exc}" for name, exc in self.errors.items())
+        return "Startup: " + ", ".join(parts)